@@ -0,0 +1,67 @@
+"""
+Compares elevation lookups through ElevationGrid with rasterio's per-point sample, which get_elevations used before.
+Needs the course and elevation raster in {DATA_PATH}/geo.
+
+Usage (from backend/): DATA_PATH=<data> python benchmarks/elevations.py [--points 20000] [--repeat 5]
+"""
+from argparse import ArgumentParser
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely.ops import nearest_points
+from lib.geo import START_LINE_ELEVATION, get_elevations, load_course, load_course_index, load_elevation_data, load_elevation_grid
+
+def rasterio_elevations(gps_data: pd.DataFrame, snap_to_course: bool) -> pd.Series:
+    """get_elevations as it was before ElevationGrid, sampling the raster file one point at a time"""
+    positions = gpd.GeoSeries(gpd.points_from_xy(gps_data.position_long, gps_data.position_lat), crs='epsg:4326')
+    if snap_to_course:
+        positions = gpd.GeoSeries(nearest_points(load_course()[0], positions.values)[0], crs='epsg:4326') # type: ignore
+    elevation = load_elevation_data()
+    samples = elevation.sample(positions.to_crs(elevation.crs).apply(lambda p: (p.x, p.y)))
+    return pd.Series([e[0] for e in samples], index=gps_data.index) - START_LINE_ELEVATION
+
+def gps_points(count: int, seed: int = 0) -> pd.DataFrame:
+    """Points scattered within 10 m of the course, like the gps track of a roll"""
+    rng = np.random.default_rng(seed)
+    course = load_course_index()
+    distance = np.sort(rng.uniform(0, course.length, count))
+    x = np.interp(distance, course.distance, course.xy[:, 0]) + rng.normal(0, 5, count)
+    y = np.interp(distance, course.distance, course.xy[:, 1]) + rng.normal(0, 5, count)
+    long, lat = course.to_lonlat.transform(x, y)
+    return pd.DataFrame({'position_long': long, 'position_lat': lat})
+
+def best_of(repeat: int, fn, *args) -> tuple[float, object]:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--points', type=int, default=20_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    load_course_index()
+    print(f"Loaded course index and elevation grid in {(time.perf_counter() - start) * 1000:.0f} ms")
+    gps_data = gps_points(args.points)
+    print(f"{args.points} points, best of {args.repeat}")
+    for snap_to_course in (False, True):
+        before, expected = best_of(args.repeat, rasterio_elevations, gps_data, snap_to_course)
+        after, actual = best_of(args.repeat, get_elevations, gps_data, snap_to_course, True)
+        interpolated, _ = best_of(args.repeat, get_elevations, gps_data, snap_to_course, True, True)
+        # snapped points differ slightly, the course index snaps to a densified copy of the line
+        difference = np.nanmax(np.abs(expected.to_numpy(dtype=float) - actual.to_numpy(dtype=float)))
+        print(f"snap_to_course={snap_to_course!s:<5}  rasterio {before * 1000:8.1f} ms  grid {after * 1000:7.1f} ms "
+              f"({before / after:.0f}x)  grid interpolated {interpolated * 1000:7.1f} ms  max difference {difference:.2f} m")
+
+if __name__ == '__main__':
+    main()
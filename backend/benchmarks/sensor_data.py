@@ -0,0 +1,43 @@
+"""
+Compares get_sensor_data with the per-sample loop it replaced, on synthetic accelerometer messages.
+
+Usage (from backend/): python benchmarks/sensor_data.py [--messages 20000] [--repeat 5]
+"""
+from argparse import ArgumentParser
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tests.test_sensor_data import CALIBRATION, FIELDS, legacy_get_sensor_data, sensor_messages
+from lib.columnar import MessageTable
+from lib.fit import get_sensor_data
+
+def best_of(repeat: int, fn, *args) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=20_000, help="messages of 10 samples each")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    messages = sensor_messages(args.messages)
+    table = MessageTable.from_records(messages)
+    print(f"{args.messages} messages, {sum(len(m['sample_time_offset']) for m in messages)} samples, best of {args.repeat}")
+    for name, fn, data in [
+        ('loop', legacy_get_sensor_data, messages),
+        ('numpy, records', get_sensor_data, messages),
+        ('numpy, MessageTable', get_sensor_data, table),
+    ]:
+        for decimation in (1, 10):
+            seconds = best_of(args.repeat, fn, CALIBRATION, data, FIELDS, decimation)
+            print(f"{name:<20} decimation {decimation:<3} {seconds * 1000:8.1f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Times API startup: a fresh interpreter imports api.main and serves its first GET /drivers through a TestClient.
+Runs against a scratch database in a temporary folder.
+
+Usage (from backend/): python benchmarks/startup.py [--repeat 7]
+"""
+from argparse import ArgumentParser
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+# run in the fresh interpreter, times are from just before the import
+CHILD = '''
+import json, time
+start = time.perf_counter()
+import api.main
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+response = TestClient(api.main.app).get('/drivers')
+assert response.status_code == 200, response.text
+print(json.dumps({'import': imported - start, 'first_response': time.perf_counter() - start}))
+'''
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=7)
+    args = parser.parse_args()
+
+    runs = []
+    with tempfile.TemporaryDirectory() as data_path:
+        os.makedirs(f'{data_path}/db')
+        env = os.environ | {'DATA_PATH': data_path, 'DB_PATH': f'{data_path}/db/srs.db', 'PYTHONPATH': SRC_PATH}
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            result = subprocess.run([sys.executable, '-c', CHILD], env=env, cwd=SRC_PATH,
+                                    capture_output=True, text=True, check=True)
+            # the last line, anything printed while starting up comes before it
+            runs.append(json.loads(result.stdout.splitlines()[-1]) | {'process': time.perf_counter() - start})
+
+    print(f"median of {args.repeat} runs")
+    for name, label in [('import', 'import api.main'), ('first_response', 'import to first /drivers'),
+                        ('process', 'process start to exit')]:
+        print(f"{label:<26} {statistics.median(run[name] for run in runs) * 1000:7.0f} ms")
+
+if __name__ == '__main__':
+    main()
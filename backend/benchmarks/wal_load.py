@@ -0,0 +1,105 @@
+"""
+Load test for the SQLite pragma profiles: reader threads request GET /rolls while another process
+commits large transactions, reporting the readers' latency for each DB_PROFILE.
+Runs against a scratch database in a temporary folder.
+
+Usage (from backend/): python benchmarks/wal_load.py [--profiles default wal] [--seconds 8] [--readers 2] [--rows 100000]
+"""
+from argparse import ArgumentParser
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+SRC_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+def seed(rolls: int):
+    from db.database import engine, create_db_and_tables, Buggy, Driver, Roll, RollDate, RollEvent, RollType
+    from sqlalchemy.orm import Session
+    create_db_and_tables()
+    with Session(engine) as session:
+        driver, buggy = Driver(name='Driver'), Buggy(name='Buggy', abbreviation='bg')
+        dates = [RollDate(year=2025, month=9, day=day, type=RollType.WEEKEND) for day in range(1, 29)]
+        session.add_all([driver, buggy, *dates])
+        for i in range(rolls):
+            roll = Roll(driver=driver, buggy=buggy, roll_date=dates[i % len(dates)], roll_number=i)
+            events = [RollEvent(roll=roll, type='roll_start', timestamp_ms=0), RollEvent(roll=roll, type='roll_end', timestamp_ms=60_000)]
+            session.add_all([roll, *events])
+        session.commit()
+
+def write(rows: int, stop, commits):
+    """Commits transactions of rows events, then deletes them, until stopped"""
+    from db.database import engine, RollEvent
+    from sqlalchemy import delete, insert
+    from sqlalchemy.orm import Session
+    while not stop.is_set():
+        with Session(engine) as session:
+            session.execute(insert(RollEvent), [dict(roll_id=1, type='load', timestamp_ms=i) for i in range(rows)])
+            session.commit()
+            session.execute(delete(RollEvent).where(RollEvent.type == 'load'))
+            session.commit()
+        commits.value += 2
+
+def run_profile(args):
+    """Runs the load test in this process, started by main with DB_PROFILE and a scratch DB_PATH set"""
+    import numpy as np
+    from fastapi.testclient import TestClient
+    from api.main import app
+
+    seed(args.rolls)
+    # without entering the client, so the lifespan (watcher, warmup) doesn't run
+    client = TestClient(app)
+    context = multiprocessing.get_context('spawn')
+    stop, commits = context.Event(), context.Value('i', 0)
+    writer = context.Process(target=write, args=(args.rows, stop, commits))
+    writer.start()
+    # let the writer start its first transaction
+    time.sleep(2)
+
+    latencies: list[float] = []
+    errors = []
+    deadline = time.perf_counter() + args.seconds
+    def read():
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            response = client.get('/rolls?limit=50')
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors.append(response.status_code)
+    readers = [threading.Thread(target=read) for _ in range(args.readers)]
+    for reader in readers: reader.start()
+    for reader in readers: reader.join()
+    stop.set()
+    writer.join()
+
+    ms = np.array(latencies) * 1000
+    print(f"{os.environ['DB_PROFILE']:<8} {len(ms):6} requests  p50 {np.percentile(ms, 50):7.1f} ms  "
+          f"p99 {np.percentile(ms, 99):7.1f} ms  max {ms.max():7.1f} ms  {commits.value} commits  {len(errors)} errors")
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--profiles', nargs='+', default=['default', 'wal'])
+    parser.add_argument('--seconds', type=float, default=8)
+    parser.add_argument('--readers', type=int, default=2)
+    parser.add_argument('--rows', type=int, default=100_000, help="events inserted by each write transaction")
+    parser.add_argument('--rolls', type=int, default=500)
+    args = parser.parse_args()
+
+    if os.getenv('WAL_LOAD_CHILD'):
+        run_profile(args)
+        return
+    # the profile is applied when the engine is created, so each one runs in a fresh process and database
+    for profile in args.profiles:
+        with tempfile.TemporaryDirectory() as data_path:
+            os.makedirs(f'{data_path}/db')
+            env = os.environ | {'DATA_PATH': data_path, 'DB_PATH': f'{data_path}/db/srs.db', 'DB_PROFILE': profile,
+                                'PYTHONPATH': SRC_PATH, 'WAL_LOAD_CHILD': '1'}
+            subprocess.run([sys.executable, __file__, '--profiles', profile, '--seconds', str(args.seconds),
+                            '--readers', str(args.readers), '--rows', str(args.rows), '--rolls', str(args.rolls)],
+                           env=env, check=True)
+
+if __name__ == '__main__':
+    main()
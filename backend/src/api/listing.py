@@ -0,0 +1,44 @@
+from collections.abc import Callable
+import hashlib
+from fastapi import Response
+from sqlalchemy import Select, func, select
+from sqlalchemy.orm import Session
+
+# response header holding the cursor for the next page of a paginated list
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+def list_etag(session: Session, *models) -> str:
+    """
+    Weak ETag for a list built from these tables, from their row counts and latest updated_at.
+    Changes whenever a row is added, updated or deleted.
+    """
+    columns = []
+    for model in models:
+        columns.append(select(func.count()).select_from(model).scalar_subquery())
+        columns.append(select(func.max(model.updated_at)).scalar_subquery())
+    versions = session.execute(select(*columns)).one()
+    return f'W/"{hashlib.sha1(repr(tuple(versions)).encode()).hexdigest()[:20]}"'
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Whether an If-None-Match header matches etag (using weak comparison)"""
+    if if_none_match is None:
+        return False
+    tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+    return '*' in tags or etag.removeprefix('W/') in tags
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={'ETag': etag})
+
+def fetch_page[T](session: Session, query: Select[tuple[T]], limit: int | None,
+                  response: Response, cursor_of: Callable[[T], str]) -> list[T]:
+    """
+    Runs a query ordered by its keyset, limited to a page of rows. One extra row is fetched
+    to tell if there's another page, in which case its cursor is set in X-Next-Cursor.
+    """
+    if limit is None:
+        return list(session.scalars(query).all())
+    rows = list(session.scalars(query.limit(limit + 1)).all())
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = cursor_of(rows[-1])
+    return rows
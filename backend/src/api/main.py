@@ -1,18 +1,64 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 import os
-from api.routers import rolls, drivers, buggies, pushers, sensors, file, exports
+import time
+from api.listing import NEXT_CURSOR_HEADER
+from api.routers import rolls, drivers, buggies, pushers, sensors, file, exports, status, metrics, hills
+from lib.executor import analytics
+from lib.graphs import warm_worker
+from lib.metrics import Recorder, count_queries, current, record_request, server_timing
 from lib.racebox import load_session
+from lib.watcher import FIT_WATCH, watcher
+from db import create_db_and_tables
+from db.database import engine, read_engine
 
-app = FastAPI()
+# set to start the analytics workers with the course and elevation raster loaded,
+# instead of loading them on the first graphs or stats request after startup
+WARMUP = os.getenv('WARMUP', '').lower() in ('1', 'true', 'yes')
+
+# creates any tables added since the database was made
+create_db_and_tables()
+count_queries(engine)
+count_queries(read_engine)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if WARMUP:
+        # workers load in their own processes, so requests are served meanwhile
+        analytics.start(warm_worker)
+    if FIT_WATCH:
+        watcher.start()
+    yield
+    watcher.stop()
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
+@app.middleware("http")
+async def time_request(request: Request, call_next):
+    """Records metrics for each request and reports where its time went in a Server-Timing header"""
+    recorder = Recorder()
+    token = current.set(recorder)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        current.reset(token)
+    seconds = time.perf_counter() - start
+    # the route's path template, so metrics aren't split by roll id
+    route = getattr(request.scope.get('route'), 'path', 'unmatched')
+    record_request(recorder, route, request.method, response.status_code, seconds)
+    response.headers['Server-Timing'] = server_timing(recorder, seconds)
+    return response
+
 app.include_router(rolls.router)
 app.include_router(drivers.router)
 app.include_router(buggies.router)
@@ -20,6 +66,9 @@ app.include_router(pushers.router)
 app.include_router(sensors.router)
 app.include_router(file.router)
 app.include_router(exports.router)
+app.include_router(status.router)
+app.include_router(metrics.router)
+app.include_router(hills.router)
 
 app.mount("/[[thumbnails]]", 
           StaticFiles(directory='/app/data/virbs'), 
@@ -1,23 +1,33 @@
 from db.database import Buggy
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Header, HTTPException, Query, Response
 from sqlalchemy import select
 from sqlalchemy.orm import selectinload
-from db import SessionDep
+from db import ReadSessionDep
+from api.listing import etag_matches, fetch_page, list_etag, not_modified
+from typing import Annotated
 
 router = APIRouter(prefix="/buggies", tags=["buggies"])
 
 @router.get("")
 def get_buggies(
-    session: SessionDep,
-    # skip: int = Query(0, ge=0),
-    # limit: int = Query(100, ge=1, le=1000)
+    session: ReadSessionDep,
+    response: Response,
+    cursor: int | None = Query(None, description="Id of the last buggy on the previous page"),
+    limit: int | None = Query(None, ge=1, le=1000),
+    if_none_match: Annotated[str | None, Header()] = None,
 ):
-    query = select(Buggy)
-    buggies = session.scalars(query).all()
-    return buggies
+    etag = list_etag(session, Buggy)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    response.headers['ETag'] = etag
+    
+    query = select(Buggy).order_by(Buggy.id)
+    if cursor is not None:
+        query = query.where(Buggy.id > cursor)
+    return fetch_page(session, query, limit, response, lambda buggy: str(buggy.id))
 
 @router.get("/{buggy_id}")
-def get_buggy(buggy_id: int, session: SessionDep):
+def get_buggy(buggy_id: int, session: ReadSessionDep):
     query = select(Buggy).options(
         selectinload(Buggy.rolls)
     ).where(Buggy.id == buggy_id)
@@ -1,23 +1,33 @@
 from db.database import Driver
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Header, HTTPException, Query, Response
 from sqlalchemy import select
 from sqlalchemy.orm import selectinload
-from db import SessionDep
+from db import ReadSessionDep
+from api.listing import etag_matches, fetch_page, list_etag, not_modified
+from typing import Annotated
 
 router = APIRouter(prefix="/drivers", tags=["drivers"])
 
 @router.get("")
 def get_drivers(
-    session: SessionDep,
-    # skip: int = Query(0, ge=0),
-    # limit: int = Query(100, ge=1, le=1000)
+    session: ReadSessionDep,
+    response: Response,
+    cursor: int | None = Query(None, description="Id of the last driver on the previous page"),
+    limit: int | None = Query(None, ge=1, le=1000),
+    if_none_match: Annotated[str | None, Header()] = None,
 ):
-    query = select(Driver)
-    drivers = session.scalars(query).all()
-    return drivers
+    etag = list_etag(session, Driver)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    response.headers['ETag'] = etag
+    
+    query = select(Driver).order_by(Driver.id)
+    if cursor is not None:
+        query = query.where(Driver.id > cursor)
+    return fetch_page(session, query, limit, response, lambda driver: str(driver.id))
 
 @router.get("/{driver_id}")
-def get_driver(driver_id: int, session: SessionDep):
+def get_driver(driver_id: int, session: ReadSessionDep):
     query = select(Driver).options(
         selectinload(Driver.rolls)
     ).where(Driver.id == driver_id)
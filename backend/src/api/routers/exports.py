@@ -1,113 +1,125 @@
-from io import StringIO
+from collections.abc import Iterator
 from fastapi import APIRouter
 from fastapi.responses import StreamingResponse
-from lib.events import calculate_hill_times, calculate_freeroll_stats
+from lib.events import calculate_hill_times
+from lib.stats import refresh_stale_roll_stats
 from sqlalchemy import select
-from sqlalchemy.orm import selectinload
-from db import SessionDep
-from db.database import Roll, RollHill, RollEvent
+from sqlalchemy.orm import Session, selectinload
+from db.database import engine, read_engine, Buggy, Driver, Roll, RollDate, RollHill, RollStats
 
 router = APIRouter(prefix="/exports", tags=["exports"])
 
-@router.get("/hills.csv")
-def export_hills(
-    session: SessionDep,
-):
+# number of rolls loaded from the database (and whose stats are calculated) at a time while streaming
+EXPORT_BATCH_SIZE = 100
+
+# Exports are generated while the response streams, so they open their own session
+# instead of using SessionDep, which is closed before the response body is sent.
+
+def hill_rows() -> Iterator[str]:
+    yield "Buggy,Driver,Pusher,Gender,Hill,Date,Time,Roll Type,Roll Number,Roll Start Time\n"
+
     query = select(Roll).options(
         selectinload(Roll.driver),
         selectinload(Roll.buggy),
         selectinload(Roll.roll_date),
         selectinload(Roll.roll_events),
         selectinload(Roll.roll_hills).selectinload(RollHill.pusher),
-    )
-    
-    rolls = session.scalars(query).all()
-    
-    output = StringIO()
-    output.write("Buggy,Driver,Pusher,Gender,Hill,Date,Time,Roll Type,Roll Number,Roll Start Time\n")
-    
-    for roll in rolls:
-        hill_times = calculate_hill_times(roll.roll_events)
-        date_str = f"{roll.roll_date.year}/{roll.roll_date.month:02d}/{roll.roll_date.day:02d}"
-        
-        for roll_hill in roll.roll_hills:
-            if roll_hill.pusher.name == "MECH": continue
-            
-            time_ms = hill_times.get(roll_hill.hill_number)
-            time_str = f"{time_ms / 1000:.1f}" if time_ms is not None else ""
-            gender = roll_hill.pusher.gender.value if roll_hill.pusher.gender else ""
-            start_time = roll.start_time.strftime("%H:%M") if roll.start_time else ""
-            roll_number = str(roll.roll_number) if roll.roll_number is not None else ""
-            
-            row = [
-                roll.buggy.name, roll.driver.name,
-                roll_hill.pusher.name, gender,
-                str(roll_hill.hill_number),
-                date_str,
-                time_str,
-                roll.roll_date.type.value,
-                roll_number,
-                start_time,
-            ]
-            output.write(",".join(row) + "\n")
-    
-    output.seek(0)
+    ).execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+    with Session(read_engine) as session:
+        for roll in session.scalars(query):
+            hill_times = calculate_hill_times(roll.roll_events)
+            date_str = f"{roll.roll_date.year}/{roll.roll_date.month:02d}/{roll.roll_date.day:02d}"
+
+            for roll_hill in roll.roll_hills:
+                if roll_hill.pusher.name == "MECH": continue
+
+                time_ms = hill_times.get(roll_hill.hill_number)
+                time_str = f"{time_ms / 1000:.1f}" if time_ms is not None else ""
+                gender = roll_hill.pusher.gender.value if roll_hill.pusher.gender else ""
+                start_time = roll.start_time.strftime("%H:%M") if roll.start_time else ""
+                roll_number = str(roll.roll_number) if roll.roll_number is not None else ""
+
+                row = [
+                    roll.buggy.name, roll.driver.name,
+                    roll_hill.pusher.name, gender,
+                    str(roll_hill.hill_number),
+                    date_str,
+                    time_str,
+                    roll.roll_date.type.value,
+                    roll_number,
+                    start_time,
+                ]
+                yield ",".join(row) + "\n"
+
+@router.get("/hills.csv")
+def export_hills():
     return StreamingResponse(
-        output,
+        hill_rows(),
         media_type="text/csv",
         headers={"Content-Disposition": "attachment; filename=hills.csv"}
     )
 
 
+def csv_text(value: str) -> str:
+    """Quotes a free text field, which can contain commas and quotes"""
+    return '"' + value.replace('"', '""') + '"'
+
+def freeroll_rows() -> Iterator[str]:
+    """
+    Rows of the freeroll export. Missing or outdated stats are calculated a batch of rolls at a time
+    just before the batch is written, so rows start streaming without waiting for all of them.
+    Rolls whose stats couldn't be calculated (or only from events) have the error in the last column.
+    """
+    yield "Buggy,Driver,Date,Roll Number,Roll Start Time,Time,Max Speed,Max Energy,Energy Loss,Pickup Energy,Pickup Speed,Rollup Height,Stats Error\n"
+
+    query = select(
+        Roll.id, Buggy.name, Driver.name,
+        RollDate.year, RollDate.month, RollDate.day,
+        Roll.roll_number, Roll.start_time,
+        RollStats.freeroll_time_ms,
+        RollStats.max_speed, RollStats.max_energy,
+        RollStats.freeroll_energy_loss,
+        RollStats.pickup_energy, RollStats.pickup_speed, RollStats.rollup_height,
+        RollStats.fit_error,
+    ).select_from(Roll).join(Roll.buggy).join(Roll.driver).join(Roll.roll_date).outerjoin(Roll.stats).order_by(Roll.id)
+
+    # writes the stats it calculates, so it uses engine rather than read_engine
+    with Session(engine) as session:
+        roll_ids = session.scalars(select(Roll.id).order_by(Roll.id)).all()
+        for start in range(0, len(roll_ids), EXPORT_BATCH_SIZE):
+            batch = roll_ids[start:start + EXPORT_BATCH_SIZE]
+            refresh = refresh_stale_roll_stats(session, roll_ids=batch)
+            for (roll_id, buggy_name, driver_name, year, month, day, roll_number, start_time, freeroll_time_ms,
+                 max_speed, max_energy, freeroll_energy_loss, pickup_energy, pickup_speed, rollup_height,
+                 fit_error) in session.execute(query.where(Roll.id.in_(batch))):
+                date_str = f"{year}/{month:02d}/{day:02d}"
+                start_time = start_time.strftime("%H:%M") if start_time else ""
+                roll_number = str(roll_number) if roll_number is not None else ""
+                error = fit_error or refresh.failed.get(roll_id)
+
+                row = [
+                    buggy_name, driver_name,
+                    date_str, roll_number, start_time,
+                    f"{freeroll_time_ms / 1000:.1f}" if freeroll_time_ms is not None else "",
+                    f"{max_speed:.2f}" if max_speed is not None else "",
+                    f"{max_energy:.2f}" if max_energy is not None else "",
+                    f"{freeroll_energy_loss:.2f}" if freeroll_energy_loss is not None else "",
+                    f"{pickup_energy:.2f}" if pickup_energy is not None else "",
+                    f"{pickup_speed:.2f}" if pickup_speed is not None else "",
+                    f"{rollup_height:.2f}" if rollup_height is not None else "",
+                    csv_text(error) if error else "",
+                ]
+                yield ",".join(row) + "\n"
+
 @router.get("/freerolls.csv")
-def export_freeroll(
-    session: SessionDep,
-):
-    query = select(Roll).options(
-        selectinload(Roll.driver),
-        selectinload(Roll.buggy),
-        selectinload(Roll.roll_date),
-        selectinload(Roll.roll_events),
-        selectinload(Roll.roll_files),
-    )
-    
-    rolls = session.scalars(query).all()
-    
-    output = StringIO()
-    output.write("Buggy,Driver,Date,Roll Number,Roll Start Time,Time,Max Speed,Max Energy,Energy Loss,Pickup Energy,Pickup Speed,Rollup Height\n")
-    
-    for roll in rolls:
-        date_str = f"{roll.roll_date.year}/{roll.roll_date.month:02d}/{roll.roll_date.day:02d}"
-        start_time = roll.start_time.strftime("%H:%M") if roll.start_time else ""
-        roll_number = str(roll.roll_number) if roll.roll_number is not None else ""
-        
-        fit_files = [rf for rf in roll.roll_files if rf.type == 'fit']
-        fit_file = fit_files[0].uri.replace('[[fit]]', 'virbs') if len(fit_files) == 1 else None
-        
-        stats = calculate_freeroll_stats(fit_file, roll.roll_events)
-        
-        freeroll_time = f"{stats['freeroll_time_ms'] / 1000:.1f}" if 'freeroll_time_ms' in stats else ""
-        max_speed = f"{stats['max_speed']:.2f}" if 'max_speed' in stats else ""
-        max_energy = f"{stats['max_energy']:.2f}" if 'max_energy' in stats else ""
-        freeroll_energy_loss = f"{stats['freeroll_energy_loss']:.2f}" if 'freeroll_energy_loss' in stats else ""
-        pickup_energy = f"{stats['pickup_energy']:.2f}" if 'pickup_energy' in stats else ""
-        pickup_speed = f"{stats['pickup_speed']:.2f}" if 'pickup_speed' in stats else ""
-        rollup_height = f"{stats['rollup_height']:.2f}" if 'rollup_height' in stats else ""
-        
-        row = [
-            roll.buggy.name, roll.driver.name,
-            date_str, roll_number, start_time,
-            freeroll_time,
-            max_speed, max_energy,
-            freeroll_energy_loss,
-            pickup_energy, pickup_speed, rollup_height,
-        ]
-        output.write(",".join(row) + "\n")
-    
-    output.seek(0)
+def export_freeroll():
+    """
+    Freeroll stats of every roll, calculating missing stats on the analytics pool while streaming.
+    Rolls whose stats fail are exported without them, with the error in the Stats Error column.
+    """
     return StreamingResponse(
-        output,
+        freeroll_rows(),
         media_type="text/csv",
         headers={"Content-Disposition": "attachment; filename=freerolls.csv"}
     )
-
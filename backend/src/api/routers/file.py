@@ -1,12 +1,12 @@
 from db.database import RollFile
 from fastapi import APIRouter
 from sqlalchemy import select, distinct
-from db import SessionDep
+from db import ReadSessionDep
 
 router = APIRouter(prefix="/files", tags=["files"])
 
 @router.get("/types")
-def get_file_types(session: SessionDep):
+def get_file_types(session: ReadSessionDep):
     """Get all distinct file types from roll files"""
     query = select(distinct(RollFile.type)).order_by(RollFile.type)
     file_types = session.scalars(query).all()
@@ -0,0 +1,26 @@
+from typing import Literal
+from fastapi import APIRouter, HTTPException, Query
+from db import ReadSessionDep
+from db.database import RollType
+from lib.events import HILL_SEGMENTS
+from lib.hills import hill_time_stats
+
+router = APIRouter(prefix="/hills", tags=["hills"])
+
+@router.get("/times")
+def get_hill_times(
+    session: ReadSessionDep,
+    group_by: Literal['pusher', 'buggy', 'driver', 'date'] = Query('pusher'),
+    hill: list[int] | None = Query(None, description="Only these hills, all by default"),
+    year: int | None = Query(None),
+    roll_type: RollType | None = Query(None),
+    min_count: int = Query(1, ge=1, description="Leave out groups with fewer timed hills"),
+):
+    """
+    Count, min, median and mean hill times (ms) per pusher, buggy, driver or roll date and hill,
+    fastest median first within each hill. Calculated in the database from roll events.
+    """
+    hills = sorted(set(hill)) if hill else None
+    if hills is not None and not set(hills) <= HILL_SEGMENTS.keys():
+        raise HTTPException(status_code=400, detail=f"Hills must be in {', '.join(map(str, HILL_SEGMENTS))}")
+    return hill_time_stats(session, group_by, hills, year, roll_type, min_count)
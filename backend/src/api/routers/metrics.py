@@ -0,0 +1,28 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from lib.executor import analytics
+from lib.graphs import graphs_cache
+from lib.metrics import format_metric, registry
+
+router = APIRouter(tags=["metrics"])
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Request, stage timing, SQL and cache metrics in Prometheus' text format"""
+    lines = registry.render()
+    cache = graphs_cache.stats()
+    lines += format_metric('srs_graphs_cache_requests_total', 'counter', "Graphs cache lookups, by where the entry was found", {
+        (('result', 'memory'),): cache['hits'],
+        (('result', 'disk'),): cache['disk_hits'],
+        (('result', 'miss'),): cache['misses'],
+    })
+    lines += format_metric('srs_graphs_cache_bytes', 'gauge', "Size of graphs held in memory", {(): cache['bytes']})
+    lines += format_metric('srs_graphs_cache_entries', 'gauge', "Number of graphs held in memory", {(): cache['entries']})
+    pool = analytics.stats()
+    lines += format_metric('srs_analytics_in_flight', 'gauge', "Jobs running or queued on the analytics pool", {(): pool['in_flight']})
+    lines += format_metric('srs_analytics_jobs_total', 'counter', "Jobs on the analytics pool, by outcome", {
+        (('result', 'submitted'),): pool['submitted'],
+        (('result', 'coalesced'),): pool['coalesced'],
+        (('result', 'failed'),): pool['failed'],
+    })
+    return PlainTextResponse('\n'.join(lines) + '\n', media_type='text/plain; version=0.0.4')
@@ -1,21 +1,33 @@
 from db.database import Pusher
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Header, HTTPException, Query, Response
 from sqlalchemy import select
 from sqlalchemy.orm import selectinload
-from db import SessionDep
+from db import ReadSessionDep
+from api.listing import etag_matches, fetch_page, list_etag, not_modified
+from typing import Annotated
 
 router = APIRouter(prefix="/pushers", tags=["pushers"])
 
 @router.get("")
 def get_pushers(
-    session: SessionDep,
+    session: ReadSessionDep,
+    response: Response,
+    cursor: int | None = Query(None, description="Id of the last pusher on the previous page"),
+    limit: int | None = Query(None, ge=1, le=1000),
+    if_none_match: Annotated[str | None, Header()] = None,
 ):
-    query = select(Pusher)
-    pushers = session.scalars(query).all()
-    return pushers
+    etag = list_etag(session, Pusher)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    response.headers['ETag'] = etag
+    
+    query = select(Pusher).order_by(Pusher.id)
+    if cursor is not None:
+        query = query.where(Pusher.id > cursor)
+    return fetch_page(session, query, limit, response, lambda pusher: str(pusher.id))
 
 @router.get("/{pusher_id}")
-def get_pusher(pusher_id: int, session: SessionDep):
+def get_pusher(pusher_id: int, session: ReadSessionDep):
     query = select(Pusher).options(
         selectinload(Pusher.roll_hills)
     ).where(Pusher.id == pusher_id)
@@ -1,19 +1,28 @@
-from db import Roll, SessionDep
+from db import Roll, ReadSessionDep, SessionDep
 from db.database import Buggy, Driver, Pusher, RollDate, RollFile, RollHill, RollType, RollEvent, Sensor
-from lib.fit import get_angular_velocity, get_camera_ends, get_camera_starts, get_gps_data, get_sensor_data, load_fit_file
-from lib.geo import get_elevations
-from lib.events import calculate_hill_times, calculate_freeroll_stats
+from lib.compare import TRACK_STEP_M, compare_tracks, load_roll_track, track_cache_key, track_window, tracks_cache
+from lib.graphs import graphs_cache, graphs_cache_key, load_roll_graphs
+from lib.maptrack import load_map_track, map_track_cache, map_track_cache_key
+from lib.stats import STATS_VERSION, refresh_roll_stats, roll_stats_dict
+from lib.executor import analytics
+from lib.metrics import span
+from lib.series import GRAPHS_MEDIA_TYPE, decode_graphs, downsample, encode_graphs
+from api.listing import etag_matches, fetch_page, list_etag, not_modified
 import numpy as np
-import pandas as pd
-from fastapi import APIRouter, Query, HTTPException
-from sqlalchemy import select
+import orjson
+from fastapi import APIRouter, Header, Query, HTTPException, Response
+from sqlalchemy import delete, insert, select, tuple_
 from sqlalchemy.orm import selectinload
 from datetime import datetime
 from pydantic import BaseModel
+from typing import Annotated, Literal
 
 
 router = APIRouter(prefix="/rolls", tags=["rolls"])
 
+# most rolls /rolls/compare takes at once
+MAX_COMPARE_ROLLS = 20
+
 class RollDateInput(BaseModel):
     year: int
     month: int
@@ -73,108 +82,167 @@ def get_or_create_rolldate(session: SessionDep, roll_date_input: RollDateInput)
         session.flush()
     return rolldate
 
-def get_or_create_sensor(session: SessionDep, abbreviation: str) -> Sensor:
-    query = select(Sensor).where(Sensor.abbreviation == abbreviation)
-    sensor = session.scalar(query)
-    if not sensor:
-        sensor = Sensor(abbreviation=abbreviation)
-        session.add(sensor)
-        session.flush()
-    return sensor
-
-def get_or_create_rollfile(session: SessionDep, 
-                           roll_file_input: RollFileInput, 
-                           roll_id: int) -> RollFile:
-    query = select(RollFile).where(
-        RollFile.type == roll_file_input.type,
-        RollFile.uri == roll_file_input.uri,
-        RollFile.roll_id == roll_id
-    )
-    roll_file = session.scalar(query)
-    if not roll_file:
-        sensor = None
-        if roll_file_input.sensor_abbreviation:
-            sensor = get_or_create_sensor(session, roll_file_input.sensor_abbreviation)
-        
-        roll_file = RollFile(
-            type=roll_file_input.type,
-            uri=roll_file_input.uri,
-            sensor=sensor,
-            roll_id=roll_id
-        )
-        session.add(roll_file)
-        session.flush()
-    return roll_file
-
-def get_or_create_pusher(session: SessionDep, name: str):
-    query = select(Pusher).where(Pusher.name == name)
-    pusher = session.scalar(query)
-    if not pusher:
-        pusher = Pusher(name=name)
-        session.add(pusher)
-        session.flush()
-    return pusher
+def resolve_pushers(session: SessionDep, names: set[str]) -> dict[str, Pusher]:
+    """Pushers by name, loaded with one query. Missing ones are created with one bulk insert"""
+    if not names:
+        return {}
+    pushers = {p.name: p for p in session.scalars(select(Pusher).where(Pusher.name.in_(names)))}
+    if missing := names - pushers.keys():
+        created = session.scalars(insert(Pusher).returning(Pusher), [dict(name=name) for name in missing])
+        pushers |= {p.name: p for p in created}
+    return pushers
+
+def resolve_sensors(session: SessionDep, abbreviations: set[str]) -> dict[str, Sensor]:
+    """Sensors by abbreviation, loaded with one query. Missing ones are created with one bulk insert"""
+    if not abbreviations:
+        return {}
+    sensors = {s.abbreviation: s for s in session.scalars(select(Sensor).where(Sensor.abbreviation.in_(abbreviations)))}
+    if missing := abbreviations - sensors.keys():
+        created = session.scalars(insert(Sensor).returning(Sensor), [dict(abbreviation=abbreviation) for abbreviation in missing])
+        sensors |= {s.abbreviation: s for s in created}
+    return sensors
 
-def get_or_create_rollhill(session: SessionDep,
-                           roll_hill_input: RollHillInput,
-                           roll_id: int):
+def sync_roll_children(session: SessionDep, roll_id: int,
+                       roll_file_inputs: list[RollFileInput],
+                       roll_hill_inputs: list[RollHillInput]):
+    """
+    Makes a roll's files and hills match the input, with a fixed number of queries
+    however many there are. Files are keyed on (type, uri) and hills on (pusher, hill_number).
+    Referenced pushers and sensors are resolved first, then rows are inserted and
+    deleted with one bulk statement each.
+    """
+    pushers = resolve_pushers(session, {rh.pusher_name for rh in roll_hill_inputs})
+    sensors = resolve_sensors(session, {rf.sensor_abbreviation for rf in roll_file_inputs if rf.sensor_abbreviation})
     
-    pusher = get_or_create_pusher(session, roll_hill_input.pusher_name)
-    query = select(RollHill).where(
-        RollHill.hill_number == roll_hill_input.hill_number,
-        RollHill.roll_id == roll_id
-    )
-    roll_hill = session.scalar(query)
-    if not roll_hill:
-        roll_hill = RollHill(
-            hill_number=roll_hill_input.hill_number,
-            pusher=pusher,
-            roll_id=roll_id
+    existing_files = {
+        (type, uri): id for id, type, uri in session.execute(
+            select(RollFile.id, RollFile.type, RollFile.uri).where(RollFile.roll_id == roll_id)
         )
-        session.add(roll_hill)
-        session.flush()
-    else:
-        roll_hill.pusher = pusher
-    return roll_hill
-
-def get_or_create_event(session: SessionDep, roll_id: int,
-                           roll_event_input: RollEventInput):
-    roll_event = session.scalar(
-        select(RollEvent).where(
-            RollEvent.roll_id == roll_id,
-            RollEvent.type == roll_event_input.type,
-            RollEvent.tag == roll_event_input.tag,
-            RollEvent.timestamp_ms == roll_event_input.timestamp_ms
+    }
+    files: dict[tuple, RollFileInput] = {}
+    for rf_input in roll_file_inputs:
+        files.setdefault((rf_input.type, rf_input.uri), rf_input)
+    
+    removed_files = [id for key, id in existing_files.items() if key not in files]
+    if removed_files:
+        session.execute(delete(RollFile).where(RollFile.id.in_(removed_files)))
+    added_files = [
+        dict(
+            roll_id=roll_id,
+            type=rf_input.type,
+            uri=rf_input.uri,
+            sensor_id=sensors[rf_input.sensor_abbreviation].id if rf_input.sensor_abbreviation else None
         )
-    )
-    if not roll_event:
-        roll_event = RollEvent(
+        for key, rf_input in files.items() if key not in existing_files
+    ]
+    if added_files:
+        session.execute(insert(RollFile), added_files)
+    
+    existing_hills = {
+        (pusher_id, hill_number): id for id, pusher_id, hill_number in session.execute(
+            select(RollHill.id, RollHill.pusher_id, RollHill.hill_number).where(RollHill.roll_id == roll_id)
+        )
+    }
+    # a hill can have several pushers, so hills are matched like the unique index (roll_id, pusher_id, hill_number)
+    hills = {(pushers[rh_input.pusher_name].id, rh_input.hill_number) for rh_input in roll_hill_inputs}
+    
+    removed_hills = [id for key, id in existing_hills.items() if key not in hills]
+    if removed_hills:
+        session.execute(delete(RollHill).where(RollHill.id.in_(removed_hills)))
+    added_hills = [
+        dict(roll_id=roll_id, pusher_id=pusher_id, hill_number=hill_number)
+        for pusher_id, hill_number in hills if (pusher_id, hill_number) not in existing_hills
+    ]
+    if added_hills:
+        session.execute(insert(RollHill), added_hills)
+
+def sync_roll_events(session: SessionDep, roll_id: int,
+                     roll_event_inputs: list[RollEventInput]):
+    """
+    Makes a roll's events match the input, keyed on (type, tag, timestamp_ms).
+    Existing events are loaded once, then missing ones are inserted and
+    removed ones deleted with one statement each.
+    """
+    existing = {
+        (type, tag, timestamp_ms): id for id, type, tag, timestamp_ms in session.execute(
+            select(RollEvent.id, RollEvent.type, RollEvent.tag, RollEvent.timestamp_ms)
+            .where(RollEvent.roll_id == roll_id)
+        )
+    }
+    submitted: dict[tuple, RollEventInput] = {}
+    for roll_event_input in roll_event_inputs:
+        submitted.setdefault((roll_event_input.type, roll_event_input.tag, roll_event_input.timestamp_ms), roll_event_input)
+    
+    removed = [id for key, id in existing.items() if key not in submitted]
+    if removed:
+        session.execute(delete(RollEvent).where(RollEvent.id.in_(removed)))
+    added = [
+        dict(
             roll_id=roll_id,
             type=roll_event_input.type,
             tag=roll_event_input.tag,
             timestamp_ms=roll_event_input.timestamp_ms,
             raw_timestamp=roll_event_input.raw_timestamp
         )
-        session.add(roll_event)
-        session.flush()
-    return roll_event
+        for key, roll_event_input in submitted.items() if key not in existing
+    ]
+    if added:
+        session.execute(insert(RollEvent), added)
+
+# relationships that can be included in the roll list, and the tables they come from
+ROLL_LIST_FIELDS = {
+    'driver': (Roll.driver, Driver),
+    'buggy': (Roll.buggy, Buggy),
+    'roll_files': (Roll.roll_files, RollFile),
+    'roll_date': (Roll.roll_date, RollDate),
+}
+
+def refresh_changed_roll_stats(session: SessionDep, roll: Roll):
+    """
+    Recalculates a roll's stats after it was changed and saved. If that fails the change is kept, the roll is
+    left without stats (counted in srs_stats_failures_total) and they're calculated again when next requested.
+    """
+    try:
+        refresh_roll_stats(session, roll)
+    except Exception as e:
+        print(f"Error calculating stats for roll {roll.id}: {e!r}")
+    session.commit()
+
+def parse_roll_cursor(cursor: str) -> tuple[int, int, int, int]:
+    """Cursors are the roll date and id of the last roll on the previous page: <year>-<month>-<day>.<id>"""
+    try:
+        date, roll_id = cursor.split('.')
+        year, month, day = date.split('-')
+        return int(year), int(month), int(day), int(roll_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor {cursor!r}")
 
 @router.get("")
 def get_rolls(
-    session: SessionDep,
+    session: ReadSessionDep,
+    response: Response,
     roll_date_id: int | None = Query(None),
     buggy_id: int | None = Query(None),
     driver_id: int | None = Query(None),
-    # skip: int = Query(0, ge=0),
-    # limit: int = Query(100, ge=1, le=1000)
+    fields: str | None = Query(None, description="Comma separated relationships to include: driver, buggy, roll_files, roll_date (default all)"),
+    cursor: str | None = Query(None, description="X-Next-Cursor from the previous page"),
+    limit: int | None = Query(None, ge=1, le=1000),
+    if_none_match: Annotated[str | None, Header()] = None,
 ):
-    query = select(Roll).options(
-        selectinload(Roll.driver),
-        selectinload(Roll.buggy),
-        selectinload(Roll.roll_files),
-        selectinload(Roll.roll_date)
-    )
+    """
+    Rolls, optionally a page at a time ordered by roll date then id.
+    Returns 304 when the rolls and included relationships haven't changed since the given ETag.
+    """
+    included = list(ROLL_LIST_FIELDS) if fields is None else [f.strip() for f in fields.split(',') if f.strip()]
+    if unknown := [f for f in included if f not in ROLL_LIST_FIELDS]:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    
+    etag = list_etag(session, Roll, *(ROLL_LIST_FIELDS[f][1] for f in included))
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    response.headers['ETag'] = etag
     
+    query = select(Roll).options(*(selectinload(ROLL_LIST_FIELDS[f][0]) for f in included))
     if roll_date_id:
         query = query.where(Roll.roll_date_id == roll_date_id)
     if buggy_id:
@@ -182,11 +250,99 @@ def get_rolls(
     if driver_id:
         query = query.where(Roll.driver_id == driver_id)
     
-    rolls = session.scalars(query).all()
-    return rolls
+    if cursor is None and limit is None:
+        return session.scalars(query).all()
+    
+    query = query.join(Roll.roll_date).order_by(RollDate.year, RollDate.month, RollDate.day, Roll.id)
+    if cursor is not None:
+        query = query.where(tuple_(RollDate.year, RollDate.month, RollDate.day, Roll.id) > parse_roll_cursor(cursor))
+    
+    def roll_cursor(roll: Roll) -> str:
+        # loaded separately so roll_date isn't added to the response when it wasn't asked for
+        roll_date = session.get(RollDate, roll.roll_date_id)
+        return f"{roll_date.year}-{roll_date.month}-{roll_date.day}.{roll.id}" # type: ignore
+    return fetch_page(session, query, limit, response, roll_cursor)
+
+@router.get("/graphs/cache")
+def get_graphs_cache_stats():
+    return graphs_cache.stats()
+
+@router.get("/compare")
+def compare_rolls(
+    session: ReadSessionDep,
+    ids: str = Query(..., description="Comma separated ids of the rolls to compare"),
+    reference: int | None = Query(None, description="Roll the others' time deltas are against, the first of ids by default"),
+    step: int = Query(1, ge=1, description=f"Spacing of the points returned, in multiples of {TRACK_STEP_M:g} m"),
+    start_m: float | None = Query(None, description="Only include points at or after this distance along the course"),
+    end_m: float | None = Query(None, description="Only include points at or before this distance along the course"),
+):
+    """
+    Elapsed time, speed and energy of each roll at the same distances along the course, with each
+    roll's time delta (ms) against the reference roll. Rolls without gps data have null tracks.
+    """
+    try:
+        roll_ids = list(dict.fromkeys(int(roll_id) for roll_id in ids.split(',')))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid ids {ids!r}")
+    if len(roll_ids) > MAX_COMPARE_ROLLS:
+        raise HTTPException(status_code=400, detail=f"Can compare at most {MAX_COMPARE_ROLLS} rolls")
+    if reference is None:
+        reference = roll_ids[0]
+    if reference not in roll_ids:
+        raise HTTPException(status_code=400, detail="Reference roll must be one of ids")
+
+    rolls = {roll.id: roll for roll in session.scalars(
+        select(Roll).options(selectinload(Roll.roll_files), selectinload(Roll.roll_events)).where(Roll.id.in_(roll_ids))
+    )}
+    missing = [roll_id for roll_id in roll_ids if roll_id not in rolls]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Rolls not found: {', '.join(map(str, missing))}")
+
+    contents: dict[int, bytes | None] = {}
+    jobs = {}
+    for roll_id in roll_ids:
+        roll = rolls[roll_id]
+        fit_files = [rf for rf in roll.roll_files if rf.type == 'fit']
+        if not fit_files:
+            contents[roll_id] = None
+            continue
+        fit_file = fit_files[0].uri.replace('[[fit]]', 'virbs')
+        start_ms, end_ms = track_window(roll.roll_events)
+        try:
+            cache_key = track_cache_key(roll_id, fit_file, start_ms, end_ms)
+        except OSError as e:
+            print(e)
+            raise HTTPException(status_code=500, detail=f"Error loading fit file: {e}")
+        with span('tracks_cache'):
+            contents[roll_id] = tracks_cache.get(cache_key)
+        if contents[roll_id] is None:
+            jobs[roll_id] = (cache_key, fit_file, start_ms, end_ms)
+
+    if jobs:
+        # every missing track is calculated at once, spread over the analytics workers
+        try:
+            results = analytics.run_many([(('track', cache_key), load_roll_track, (fit_file, start_ms, end_ms))
+                                          for cache_key, fit_file, start_ms, end_ms in jobs.values()])
+        except Exception as e:
+            print(e)
+            raise HTTPException(status_code=500, detail=f"Error loading fit file: {e}")
+        for (roll_id, (cache_key, *_)), content in zip(jobs.items(), results):
+            tracks_cache.put(cache_key, content)
+            contents[roll_id] = content
+
+    with span('compare'):
+        tracks = [None if content is None else decode_graphs(content).get('track') for content in contents.values()]
+        comparison = compare_tracks(tracks, roll_ids.index(reference), step, start_m, end_m)
+    with span('serialize'):
+        content = orjson.dumps({
+            'distance': comparison['distance'],
+            'reference': reference,
+            'rolls': [{'id': roll_id, **track} for roll_id, track in zip(roll_ids, comparison['tracks'])],
+        }, option=orjson.OPT_SERIALIZE_NUMPY)
+    return Response(content=content, media_type="application/json")
 
 @router.get('/{roll_id}')
-def get_roll(roll_id: int, session: SessionDep):
+def get_roll(roll_id: int, session: ReadSessionDep):
     query = select(Roll).options(
         selectinload(Roll.driver),
         selectinload(Roll.buggy),
@@ -208,6 +364,7 @@ def update_roll(roll_id: int, roll_data: RollUpdate, session: SessionDep):
     roll = session.get(Roll, roll_id)
     if not roll:
         raise HTTPException(status_code=404, detail="Roll not found")
+    old_files = {(rf.type, rf.uri) for rf in roll.roll_files}
 
     roll.driver_notes = roll_data.driver_notes
     roll.mech_notes = roll_data.mech_notes
@@ -230,8 +387,7 @@ def update_roll(roll_id: int, roll_data: RollUpdate, session: SessionDep):
     
     rolldate = get_or_create_rolldate(session, roll_data.roll_date)
     roll.roll_date = rolldate
-    roll.roll_files = [get_or_create_rollfile(session, rf_input, roll.id) for rf_input in roll_data.roll_files]
-    roll.roll_hills = [get_or_create_rollhill(session, rh_input, roll.id) for rh_input in roll_data.roll_hills]
+    sync_roll_children(session, roll.id, roll_data.roll_files, roll_data.roll_hills)
     
     # session.flush()
     # print(get_roll(roll_id, session))
@@ -239,6 +395,12 @@ def update_roll(roll_id: int, roll_data: RollUpdate, session: SessionDep):
     session.commit()
     session.refresh(roll)
     
+    if {(rf.type, rf.uri) for rf in roll.roll_files} != old_files:
+        graphs_cache.invalidate(roll_id)
+        map_track_cache.invalidate(roll_id)
+        tracks_cache.invalidate(roll_id)
+        refresh_changed_roll_stats(session, roll)
+    
     return get_roll(roll_id, session)
 
 @router.post("")
@@ -269,8 +431,7 @@ def create_roll(roll_data: RollUpdate, session: SessionDep):
     session.add(roll)
     session.flush()
     
-    roll.roll_files = [get_or_create_rollfile(session, rf_input, roll.id) for rf_input in roll_data.roll_files]
-    roll.roll_hills = [get_or_create_rollhill(session, rh_input, roll.id) for rh_input in roll_data.roll_hills]
+    sync_roll_children(session, roll.id, roll_data.roll_files, roll_data.roll_hills)
     
     # session.flush()
     # print(get_roll(roll_id, session))
@@ -278,18 +439,23 @@ def create_roll(roll_data: RollUpdate, session: SessionDep):
     session.commit()
     session.refresh(roll)
     
+    refresh_changed_roll_stats(session, roll)
+    
     return get_roll(roll.id, session)
 
-# TMP: for dev
-cached_id = None
-cached = None
-
 @router.get("/{roll_id}/graphs")
-def get_roll_graphs(roll_id: int, session: SessionDep):
-    global cached_id, cached
-    if roll_id == cached_id and cached is not None:
-        return cached
-    
+def get_roll_graphs(
+    roll_id: int,
+    session: ReadSessionDep,
+    points: int | None = Query(None, ge=2, description="Approximate max number of points per series"),
+    start_ms: int | None = Query(None, description="Only include data at or after this timestamp"),
+    end_ms: int | None = Query(None, description="Only include data at or before this timestamp"),
+    accept: Annotated[str | None, Header()] = None,
+):
+    """
+    Graph data for a roll. Returned as json, or in the binary format described in lib/series.py
+    when the request accepts application/vnd.srs.graphs.
+    """
     roll = session.scalar(
         select(Roll).options(selectinload(Roll.roll_files)).where(Roll.id == roll_id)
     )    
@@ -301,64 +467,92 @@ def get_roll_graphs(roll_id: int, session: SessionDep):
         return {}
     fit_file = fit_files[0].uri.replace('[[fit]]', 'virbs')
     try:
-        messages = load_fit_file(fit_file)
+        cache_key = graphs_cache_key(roll_id, fit_file)
+        with span('graphs_cache'):
+            content = graphs_cache.get(cache_key)
+        if content is None:
+            content = analytics.run(('graphs', cache_key), load_roll_graphs, fit_file)
+            graphs_cache.put(cache_key, content)
     except Exception as e:
         print(e)
         raise HTTPException(status_code=500, detail=f"Error loading fit file: {e}")
     
-    response = {}
-    gps_data = get_gps_data(messages)
-    if gps_data is not None:
-        response['gps_data'] = pd.DataFrame({
-            'timestamp': gps_data.index,
-            'lat': gps_data.position_lat,
-            'long': gps_data.position_long,
-            'elevation': get_elevations(gps_data, snap_to_course=True, subtract_start_line=True),
-            'speed': gps_data.speed,
-        }).to_dict(orient='list')
-        angular_velocity = get_angular_velocity(gps_data, 1)
-        response['centripetal'] = pd.DataFrame({
-            'timestamp': angular_velocity.index,
-            'values': angular_velocity * gps_data.speed.loc[angular_velocity.index]  # v^2 / r = v * omega
-        }).to_dict(orient='list')
-        
-    
-    # TODO: handle multiple calibration messages (for gyro)
-    if 'three_d_sensor_calibration_mesgs' in messages:
-        calibration_mesgs = messages['three_d_sensor_calibration_mesgs']
-        calibration_data = { m['sensor_type']: m for m in calibration_mesgs }
-        if 'accelerometer' in calibration_data and 'accelerometer_data_mesgs' in messages:
-            accel_cal = calibration_data['accelerometer']
-            _, accel_data, _ = get_sensor_data(accel_cal, 
-                                               messages['accelerometer_data_mesgs'], # type: ignore
-                                               {'x': 'accel_x', 'y': 'accel_y', 'z': 'accel_z'},
-                                               decimation=20)
-            # makes these positive for forward facing virb
-            accel_data.x *= -1
-            accel_data.y *= -1
-            response['accelerometer'] = accel_data.to_dict(orient='list')
-        if 'gyroscope' in calibration_data and 'gyroscope_data_mesgs' in messages:
-            gyro_cal = calibration_data['gyroscope']
-            _, gyro_data, _ = get_sensor_data(gyro_cal, 
-                                              messages['gyroscope_data_mesgs'], # type: ignore
-                                              {'x': 'gyro_x', 'y': 'gyro_y', 'z': 'gyro_z'},
-                                              decimation=20)
-            response['gyroscope'] = gyro_data.to_dict(orient='list')
-        if 'compass' in calibration_data and 'magnetometer_data_mesgs' in messages:
-            mag_cal = calibration_data['compass']
-            _, mag_data, _ = get_sensor_data(mag_cal, 
-                                             messages['magnetometer_data_mesgs'], # type: ignore
-                                             {'x': 'mag_x', 'y': 'mag_y', 'z': 'mag_z'},
-                                             decimation=20)
-            response['magnetometer'] = mag_data.to_dict(orient='list')
-    response['camera_starts'] = get_camera_starts(messages)
-    response['camera_ends'] = get_camera_ends(messages)
-    cached_id = roll_id
-    cached = response
-    return response
+    binary = accept is not None and GRAPHS_MEDIA_TYPE in accept
+    headers = {'Vary': 'Accept'}
+    if points is None and start_ms is None and end_ms is None:
+        if binary:
+            return Response(content=content, media_type=GRAPHS_MEDIA_TYPE, headers=headers)
+        graphs = decode_graphs(content)
+    else:
+        with span('downsample'):
+            graphs = {name: downsample(value, points, start_ms, end_ms) if isinstance(value, dict) else value
+                      for name, value in decode_graphs(content).items()}
+        if binary:
+            with span('serialize'):
+                content = encode_graphs(graphs)
+            return Response(content=content, media_type=GRAPHS_MEDIA_TYPE, headers=headers)
+    
+    with span('serialize'):
+        content = orjson.dumps(graphs, option=orjson.OPT_SERIALIZE_NUMPY)
+    return Response(content=content, media_type="application/json", headers=headers)
+
+@router.get("/{roll_id}/track")
+def get_roll_track(
+    roll_id: int,
+    session: ReadSessionDep,
+    tolerance: float | None = Query(None, ge=0, description="Only the least detailed track simplified to within this many m (the most detailed if none are)"),
+    format: Literal['geojson', 'polyline'] = Query('geojson'),
+):
+    """
+    A roll's gps track for the map, simplified with Douglas-Peucker at each of MAP_TRACK_TOLERANCES_M,
+    with the timestamp and speed of each vertex. As a GeoJSON FeatureCollection with a LineString per
+    tolerance, or as encoded polylines (precision 6).
+    """
+    roll = session.scalar(
+        select(Roll).options(selectinload(Roll.roll_files)).where(Roll.id == roll_id)
+    )
+    if not roll:
+        raise HTTPException(status_code=404, detail="Roll not found")
+
+    fit_files = [rf for rf in roll.roll_files if rf.type == 'fit']
+    if not fit_files:
+        return {}
+    fit_file = fit_files[0].uri.replace('[[fit]]', 'virbs')
+    try:
+        cache_key = map_track_cache_key(roll_id, fit_file)
+        with span('map_track_cache'):
+            content = map_track_cache.get(cache_key)
+        if content is None:
+            content = analytics.run(('map_track', cache_key), load_map_track, fit_file)
+            map_track_cache.put(cache_key, content)
+    except Exception as e:
+        print(e)
+        raise HTTPException(status_code=500, detail=f"Error loading fit file: {e}")
+
+    track = decode_graphs(content)
+    levels = [(tolerance_m, track[f'level{i}'], polyline)
+              for i, (tolerance_m, polyline) in enumerate(zip(track['tolerances_m'], track['polylines']))]
+    if tolerance is not None:
+        levels = [level for level in levels if level[0] <= tolerance][-1:] or levels[:1]
+
+    with span('serialize'):
+        if format == 'polyline':
+            content = orjson.dumps({'tracks': [{
+                'tolerance_m': tolerance_m,
+                'polyline': polyline,
+                'timestamp': level['timestamp'],
+                'speed': level['speed'],
+            } for tolerance_m, level, polyline in levels]}, option=orjson.OPT_SERIALIZE_NUMPY)
+            return Response(content=content, media_type="application/json")
+        content = orjson.dumps({'type': 'FeatureCollection', 'features': [{
+            'type': 'Feature',
+            'geometry': {'type': 'LineString', 'coordinates': np.column_stack([level['long'], level['lat']])},
+            'properties': {'tolerance_m': tolerance_m, 'timestamp': level['timestamp'], 'speed': level['speed']},
+        } for tolerance_m, level, _ in levels]}, option=orjson.OPT_SERIALIZE_NUMPY)
+    return Response(content=content, media_type="application/geo+json")
 
 @router.get("/{roll_id}/events")
-def get_roll_events(roll_id: int, session: SessionDep):
+def get_roll_events(roll_id: int, session: ReadSessionDep):
     roll = session.scalar(
         select(Roll).options(selectinload(Roll.roll_events)).where(Roll.id == roll_id)
     )    
@@ -368,48 +562,37 @@ def get_roll_events(roll_id: int, session: SessionDep):
 
 @router.put("/{roll_id}/events")
 def update_roll_events(roll_id: int, events: list[RollEventInput], session: SessionDep):
-    roll = session.scalar(
-        select(Roll).options(selectinload(Roll.roll_events)).where(Roll.id == roll_id)
-    )    
+    roll = session.get(Roll, roll_id)
     if not roll:
         raise HTTPException(status_code=404, detail="Roll not found")
     
-    
-    roll.roll_events = [get_or_create_event(session, roll_id, event_input) for event_input in events]
-    # session.flush()
-    # print(roll.roll_events)
-    # session.rollback()
+    sync_roll_events(session, roll_id, events)
     session.commit()
-    session.refresh(roll)
+    # tracks are cut at the roll's start and end events
+    tracks_cache.invalidate(roll_id)
+
+    refresh_changed_roll_stats(session, roll)
     return roll.roll_events
 
 @router.get("/{roll_id}/stats")
 def get_roll_stats(roll_id: int, session: SessionDep):
     query = select(Roll).options(
           selectinload(Roll.roll_files),
-          selectinload(Roll.roll_events)
+          selectinload(Roll.roll_events),
+          selectinload(Roll.stats)
     ).where(Roll.id == roll_id)
     
     roll = session.scalar(query)
     if not roll:
         raise HTTPException(status_code=404, detail="Roll not found")
     
-    stats = {}
-    roll_starts = [e.timestamp_ms for e in roll.roll_events if e.type == 'roll_start']
-    roll_ends = [e.timestamp_ms for e in roll.roll_events if e.type == 'roll_end']
-    
-    hill_times = calculate_hill_times(roll.roll_events)
-    for hill_num, time_ms in hill_times.items():
-        if time_ms is not None:
-            stats[f'hill{hill_num}_time_ms'] = time_ms
-    
-    if len(roll_starts) == 1 and len(roll_ends) == 1:
-        stats['course_time_ms'] = roll_ends[0] - roll_starts[0]
-    
-    fit_files = [rf for rf in roll.roll_files if rf.type == 'fit']
-    fit_file = fit_files[0].uri.replace('[[fit]]', 'virbs') if len(fit_files) == 1 else None
-    
-    freeroll_stats = calculate_freeroll_stats(fit_file, roll.roll_events)
-    stats.update(freeroll_stats)
+    stats = roll.stats
+    if stats is None or stats.version != STATS_VERSION:
+        try:
+            stats = refresh_roll_stats(session, roll)
+        except Exception as e:
+            session.commit()
+            raise HTTPException(status_code=500, detail=f"Error calculating stats: {e}")
+        session.commit()
     
-    return stats
\ No newline at end of file
+    return roll_stats_dict(stats)
@@ -1,21 +1,33 @@
 from db.database import Sensor
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Header, HTTPException, Query, Response
 from sqlalchemy import select
 from sqlalchemy.orm import selectinload
-from db import SessionDep
+from db import ReadSessionDep
+from api.listing import etag_matches, fetch_page, list_etag, not_modified
+from typing import Annotated
 
 router = APIRouter(prefix="/sensors", tags=["sensors"])
 
 @router.get("")
 def get_sensors(
-    session: SessionDep,
+    session: ReadSessionDep,
+    response: Response,
+    cursor: int | None = Query(None, description="Id of the last sensor on the previous page"),
+    limit: int | None = Query(None, ge=1, le=1000),
+    if_none_match: Annotated[str | None, Header()] = None,
 ):
-    query = select(Sensor)
-    sensors = session.scalars(query).all()
-    return sensors
+    etag = list_etag(session, Sensor)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    response.headers['ETag'] = etag
+    
+    query = select(Sensor).order_by(Sensor.id)
+    if cursor is not None:
+        query = query.where(Sensor.id > cursor)
+    return fetch_page(session, query, limit, response, lambda sensor: str(sensor.id))
 
 @router.get("/{sensor_id}")
-def get_sensor(sensor_id: int, session: SessionDep):
+def get_sensor(sensor_id: int, session: ReadSessionDep):
     query = select(Sensor).options(
         selectinload(Sensor.roll_files)
     ).where(Sensor.id == sensor_id)
@@ -0,0 +1,15 @@
+from fastapi import APIRouter
+from lib.executor import analytics
+from lib.watcher import watcher
+
+router = APIRouter(prefix="/status", tags=["status"])
+
+@router.get("/analytics")
+def get_analytics_status():
+    """Load on the process pool used for graphs and stats"""
+    return analytics.stats()
+
+@router.get("/watcher")
+def get_watcher_status():
+    """Progress of precomputing caches for new FIT files in data/virbs"""
+    return watcher.stats()
@@ -3,13 +3,44 @@ from typing import Annotated
 from datetime import datetime, timezone
 from enum import Enum
 from fastapi import Depends
-from sqlalchemy import create_engine, Index, CheckConstraint, event, ForeignKey
+from sqlalchemy import create_engine, inspect, Index, CheckConstraint, event, ForeignKey
 from sqlalchemy.orm import declarative_base, relationship, Session, Mapped, mapped_column
 
 DATA_PATH = os.getenv('DATA_PATH', '/app/data')
 DB_PATH = os.getenv('DB_PATH', f'{DATA_PATH}/db/srs.db')
 DB_URI = f'sqlite:///{DB_PATH}'
-engine = create_engine(DB_URI, connect_args={"check_same_thread": False})
+# pragmas set on every connection, choose with DB_PROFILE
+DB_PROFILES = {
+    # SQLite's defaults (rollback journal, writers block readers while committing)
+    'default': {},
+    'wal': {
+        'journal_mode': 'WAL',  # readers see the last commit while a write is in progress
+        'synchronous': 'NORMAL',  # only syncs on checkpoints, still safe against corruption in WAL mode
+        'mmap_size': int(os.getenv('DB_MMAP_SIZE', 256 * 2**20)),
+        'cache_size': -int(os.getenv('DB_CACHE_KIB', 64 * 2**10)),  # negative is in KiB
+        'temp_store': 'MEMORY',
+        'busy_timeout': int(os.getenv('DB_BUSY_TIMEOUT_MS', 5000)),
+    },
+}
+DB_PROFILE = os.getenv('DB_PROFILE', 'wal')
+
+def make_engine(query_only: bool = False):
+    engine = create_engine(DB_URI, connect_args={"check_same_thread": False})
+    
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, _):
+        cursor = dbapi_connection.cursor()
+        for name, value in DB_PROFILES[DB_PROFILE].items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        if query_only:
+            cursor.execute('PRAGMA query_only = ON')
+        cursor.close()
+    
+    return engine
+
+engine = make_engine()
+# separate pool of connections that can't write, so reads don't wait for connections held by writes
+read_engine = make_engine(query_only=True)
 
 Base = declarative_base()
 
@@ -120,6 +151,7 @@ class Roll(TimestampModel):
     roll_files: Mapped[list["RollFile"]] = relationship(back_populates="roll", cascade="delete, delete-orphan")
     roll_events: Mapped[list["RollEvent"]] = relationship(back_populates="roll", cascade="delete, delete-orphan")
     roll_hills: Mapped[list["RollHill"]] = relationship(back_populates="roll", cascade="delete, delete-orphan")
+    stats: Mapped["RollStats | None"] = relationship(back_populates="roll", cascade="delete, delete-orphan")
     
     __table_args__ = (
         CheckConstraint(
@@ -182,7 +214,44 @@ class RollHill(TimestampModel):
     def __repr__(self):
         return f"RollHill(id={self.id}, roll_id={self.roll_id}, pusher_id={self.pusher_id}, hill_number={self.hill_number})"
 
+class RollStats(TimestampModel):
+    """Stats calculated from a roll's events and FIT file, recalculated when those change"""
+    __tablename__ = "rollstats"
+    
+    roll_id: Mapped[int] = mapped_column(ForeignKey("roll.id"), primary_key=True)
+    version: Mapped[int] = mapped_column()
+    
+    course_time_ms: Mapped[int | None] = mapped_column()
+    hill1_time_ms: Mapped[int | None] = mapped_column()
+    hill2_time_ms: Mapped[int | None] = mapped_column()
+    hill3_time_ms: Mapped[int | None] = mapped_column()
+    hill4_time_ms: Mapped[int | None] = mapped_column()
+    hill5_time_ms: Mapped[int | None] = mapped_column()
+    freeroll_time_ms: Mapped[int | None] = mapped_column()
+    video_roll_start_ms: Mapped[int | None] = mapped_column()
+    video_roll_end_ms: Mapped[int | None] = mapped_column()
+    max_speed: Mapped[float | None] = mapped_column()
+    max_energy: Mapped[float | None] = mapped_column()
+    freeroll_energy_loss: Mapped[float | None] = mapped_column()
+    pickup_timestamp_ms: Mapped[int | None] = mapped_column()
+    pickup_energy: Mapped[float | None] = mapped_column()
+    pickup_speed: Mapped[float | None] = mapped_column()
+    rollup_height: Mapped[float | None] = mapped_column()
+    # why the stats from the FIT file are missing, the ones from events are still stored
+    fit_error: Mapped[str | None] = mapped_column()
+    
+    roll: Mapped["Roll"] = relationship(back_populates="stats")
+    
+    def __repr__(self):
+        return f"RollStats(roll_id={self.roll_id}, version={self.version})"
+
 def create_db_and_tables():
+    # rollstats only holds values calculated from other tables, so if its columns changed it's
+    # recreated and the stats are calculated again, instead of migrating it
+    inspector = inspect(engine)
+    if inspector.has_table(RollStats.__tablename__) and \
+            {column['name'] for column in inspector.get_columns(RollStats.__tablename__)} != set(RollStats.__table__.columns.keys()):
+        RollStats.__table__.drop(engine)
     Base.metadata.create_all(engine)
 
 def get_session():
@@ -191,5 +260,12 @@ def get_session():
         
 SessionDep = Annotated[Session, Depends(get_session)]
 
+def get_read_session():
+    with Session(read_engine) as session:
+        yield session
+
+# for endpoints that only read, writing with it raises an error
+ReadSessionDep = Annotated[Session, Depends(get_read_session)]
+
 if __name__ == "__main__":
     create_db_and_tables()
\ No newline at end of file
@@ -0,0 +1,157 @@
+from collections import OrderedDict
+from collections.abc import Callable
+import hashlib
+import os
+import shutil
+import threading
+
+
+class ResponseCache:
+    """
+    LRU cache of serialized responses, bounded by total size in bytes.
+    Entries are also written to disk so they survive restarts and evictions.
+
+    Keys are tuples starting with a group id (e.g. the roll id) so all entries
+    for a group can be invalidated together.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict[tuple, bytes] = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def _path(self, key: tuple) -> str:
+        digest = hashlib.sha1(repr(key[1:]).encode()).hexdigest()
+        return os.path.join(self.directory, str(key[0]), f'{digest}.bin')
+
+    def _store(self, key: tuple, value: bytes):
+        if key in self.entries:
+            self.size -= len(self.entries.pop(key))
+        if len(value) > self.max_bytes: return
+        self.entries[key] = value
+        self.size += len(value)
+        while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def get(self, key: tuple) -> bytes | None:
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+        try:
+            with open(self._path(key), 'rb') as f:
+                value = f.read()
+        except OSError:
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.disk_hits += 1
+            self._store(key, value)
+        return value
+
+    def contains(self, key: tuple) -> bool:
+        """Whether key is cached in memory or on disk, without reading it"""
+        with self.lock:
+            if key in self.entries:
+                return True
+        return os.path.exists(self._path(key))
+
+    def put(self, key: tuple, value: bytes):
+        with self.lock:
+            self._store(key, value)
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # unique per process and thread, since the API, its watcher and srs-ingest workers can write the same key
+        tmp_path = f'{path}.tmp{os.getpid()}.{threading.get_ident()}'
+        with open(tmp_path, 'wb') as f:
+            f.write(value)
+        os.replace(tmp_path, path)
+
+    def invalidate(self, group) -> None:
+        """Drops all entries (in memory and on disk) whose key starts with group"""
+        with self.lock:
+            for key in [k for k in self.entries if k[0] == group]:
+                self.size -= len(self.entries.pop(key))
+        shutil.rmtree(os.path.join(self.directory, str(group)), ignore_errors=True)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+            }
+
+
+class MemoryCache[T]:
+    """
+    LRU cache of objects in memory, bounded by their estimated total size in bytes.
+
+    Keys are tuples starting with a group id (e.g. a file path) so all entries
+    for a group can be invalidated together.
+    """
+
+    def __init__(self, max_bytes: int, sizeof: Callable[[T], int]):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.entries: OrderedDict[tuple, tuple[T, int]] = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: tuple) -> T | None:
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+            return None
+
+    def put(self, key: tuple, value: T):
+        size = self.sizeof(value)
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            if size > self.max_bytes: return
+            self.entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= evicted
+                self.evictions += 1
+
+    def invalidate(self, group, keep: tuple | None = None) -> int:
+        """
+        Drops entries whose key starts with group, except those whose key continues with keep
+        (e.g. the current version of a file). Returns the number of entries dropped.
+        """
+        with self.lock:
+            keys = [k for k in self.entries if k[0] == group and (keep is None or k[1:1 + len(keep)] != keep)]
+            for key in keys:
+                self.size -= self.entries.pop(key)[1]
+        return len(keys)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,199 @@
+"""
+Channels derived from a roll's FIT file (speed, elevation, energy, calibrated sensor data, ...),
+shared by graphs and stats so each is computed once per version of the file.
+
+Each channel is a function of the channels (or FIT message types, named *_mesgs) it depends on,
+registered with `@channel(*dependencies)`. Channels are computed when first asked for and kept
+with the file's other channels in `roll_channels`, bounded by their estimated size. Only derived
+values are kept there: the FIT messages they're computed from are held (and counted) by lib.fit's
+`fit_messages`, and only referenced here while channels are being computed.
+"""
+from collections.abc import Callable, Iterable
+import os
+import sys
+from typing import Any
+import numpy as np
+from lib.cache import MemoryCache
+from lib.columnar import MessageTable
+from lib.fit import fit_identity, get_angular_velocity, get_camera_ends, get_camera_starts, get_gps_data, get_sensor_data, load_fit_file
+from lib.metrics import span
+
+# budget for derived channels held in memory by each process, by their estimated size
+CHANNELS_MEMORY_BYTES = int(os.getenv('CHANNELS_MEMORY_BYTES', 256 * 2**20))
+# sensor data is decimated to this fraction of its sample rate
+SENSOR_DECIMATION = 20
+
+CHANNELS: dict[str, tuple[Callable, tuple[str, ...]]] = {}
+
+def channel(*dependencies: str):
+    """Registers a channel named after the function, which is called with the values of its dependencies"""
+    def register(fn: Callable) -> Callable:
+        CHANNELS[fn.__name__] = (fn, dependencies)
+        return fn
+    return register
+
+def _messages(name: str, table: MessageTable | None) -> dict[str, MessageTable]:
+    """FIT messages of one type, for the functions in lib.fit that take all of a file's messages"""
+    return {} if table is None else {name: table}
+
+def _nbytes(value) -> int:
+    if isinstance(value, (MessageTable, np.ndarray)):
+        return value.nbytes
+    if isinstance(value, tuple):
+        return sum(_nbytes(v) for v in value)
+    if hasattr(value, 'memory_usage'):
+        # DataFrame or Series
+        return int(np.sum(value.memory_usage(deep=True)))
+    return sys.getsizeof(value)
+
+class RollChannels:
+    """Channels of one version of a FIT file, computed as they're asked for"""
+
+    def __init__(self, fit_file: str):
+        self.fit_file = fit_file
+        # FIT messages loaded for the channels being computed, see `release_messages`
+        self.messages: dict[str, MessageTable | None] = {}
+        self.values: dict[str, Any] = {}
+
+    def message_types(self, names: Iterable[str]) -> set[str]:
+        """FIT message types needed for these channels that haven't been loaded yet"""
+        types = set()
+        for name in names:
+            if name.endswith('_mesgs'):
+                if name not in self.messages: types.add(name)
+            elif name not in self.values:
+                types |= self.message_types(CHANNELS[name][1])
+        return types
+
+    def load(self, names: Iterable[str]):
+        """Loads the FIT messages needed for these channels with one read of the FIT cache"""
+        types = self.message_types(names)
+        if types:
+            messages = load_fit_file(self.fit_file, types)
+            self.messages |= {name: messages.get(name) for name in types}
+
+    def __getitem__(self, name: str):
+        if name.endswith('_mesgs'):
+            if name not in self.messages: self.load([name])
+            return self.messages[name]
+        if name not in self.values:
+            fn, dependencies = CHANNELS[name]
+            # dependencies first, so each channel's span only times its own work
+            args = [self[dependency] for dependency in dependencies]
+            with span(name):
+                self.values[name] = fn(*args)
+        return self.values[name]
+
+    def release_messages(self):
+        """Drops references to FIT messages, so evicting them from `fit_messages` frees their memory"""
+        self.messages.clear()
+
+    @property
+    def nbytes(self) -> int:
+        """Estimated size of the derived values (FIT messages are counted by `fit_messages`)"""
+        return sum(_nbytes(v) for v in self.values.values())
+
+channels_cache = MemoryCache[RollChannels](CHANNELS_MEMORY_BYTES, lambda channels: channels.nbytes)
+
+def roll_channels(fit_file: str, names: Iterable[str]) -> RollChannels:
+    """Channels of a FIT file with these channels computed, reusing any computed earlier for the same version of the file"""
+    key = fit_identity(fit_file)
+    channels = channels_cache.get(key)
+    if channels is None:
+        # channels of an older version of the file won't be used again
+        channels_cache.invalidate(key[0], keep=key[1:])
+        channels = RollChannels(fit_file)
+    names = list(names)
+    channels.load(names)
+    try:
+        for name in names:
+            channels[name]
+    finally:
+        channels.release_messages()
+    # stored again so its size includes the channels just computed
+    channels_cache.put(key, channels)
+    return channels
+
+@channel('camera_event_mesgs')
+def camera_starts(camera_events: MessageTable | None) -> list[int]:
+    return get_camera_starts(_messages('camera_event_mesgs', camera_events))
+
+@channel('camera_event_mesgs')
+def camera_ends(camera_events: MessageTable | None) -> list[int]:
+    return get_camera_ends(_messages('camera_event_mesgs', camera_events))
+
+@channel('gps_metadata_mesgs')
+def gps(gps_metadata: MessageTable | None):
+    """Gps data from `get_gps_data`, None if the file has none"""
+    return get_gps_data(_messages('gps_metadata_mesgs', gps_metadata))
+
+@channel('gps')
+def speed(gps):
+    return None if gps is None else gps.speed
+
+@channel('gps')
+def course_projection(gps):
+    """Gps points snapped to the course, a `CourseProjection`"""
+    if gps is None: return None
+    # imported here so geopandas and rasterio are only loaded by the processes that use them
+    from lib.geo import load_course_index
+    return load_course_index().project(gps.position_long.to_numpy(), gps.position_lat.to_numpy())
+
+@channel('gps', 'course_projection')
+def elevation(gps, course_projection):
+    """Elevation (m) relative to the start line, with gps points snapped to the course (same as `get_elevations`)"""
+    if gps is None: return None
+    import pandas as pd
+    from lib.geo import START_LINE_ELEVATION
+    return pd.Series(course_projection.elevation, index=gps.index) - START_LINE_ELEVATION
+
+@channel('gps', 'course_projection')
+def distance(gps, course_projection):
+    """Distance (m) along the course from the start line"""
+    if gps is None: return None
+    import pandas as pd
+    return pd.Series(course_projection.distance, index=gps.index)
+
+@channel('speed', 'elevation')
+def energy(speed, elevation):
+    """Kinetic plus potential energy per unit mass (J/kg)"""
+    return None if speed is None else speed ** 2 / 2 + elevation * 9.81
+
+@channel('gps')
+def angular_velocity(gps):
+    return None if gps is None else get_angular_velocity(gps, 1)
+
+@channel('angular_velocity', 'speed')
+def centripetal(angular_velocity, speed):
+    # v^2 / r = v * omega
+    return None if angular_velocity is None else angular_velocity * speed.loc[angular_velocity.index]
+
+# TODO: handle multiple calibration messages (for gyro)
+@channel('three_d_sensor_calibration_mesgs')
+def calibration(calibration_mesgs: MessageTable | None) -> dict:
+    """Calibration of each sensor type"""
+    return {} if calibration_mesgs is None else {m['sensor_type']: m for m in calibration_mesgs}
+
+@channel('calibration', 'accelerometer_data_mesgs')
+def accelerometer(calibration: dict, messages: MessageTable | None):
+    if 'accelerometer' not in calibration or messages is None: return None
+    _, data, _ = get_sensor_data(calibration['accelerometer'], messages,
+                                 {'x': 'accel_x', 'y': 'accel_y', 'z': 'accel_z'}, decimation=SENSOR_DECIMATION)
+    # makes these positive for forward facing virb
+    data.x *= -1
+    data.y *= -1
+    return data
+
+@channel('calibration', 'gyroscope_data_mesgs')
+def gyroscope(calibration: dict, messages: MessageTable | None):
+    if 'gyroscope' not in calibration or messages is None: return None
+    _, data, _ = get_sensor_data(calibration['gyroscope'], messages,
+                                 {'x': 'gyro_x', 'y': 'gyro_y', 'z': 'gyro_z'}, decimation=SENSOR_DECIMATION)
+    return data
+
+@channel('calibration', 'magnetometer_data_mesgs')
+def magnetometer(calibration: dict, messages: MessageTable | None):
+    if 'compass' not in calibration or messages is None: return None
+    _, data, _ = get_sensor_data(calibration['compass'], messages,
+                                 {'x': 'mag_x', 'y': 'mag_y', 'z': 'mag_z'}, decimation=SENSOR_DECIMATION)
+    return data
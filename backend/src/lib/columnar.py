@@ -0,0 +1,219 @@
+from collections.abc import Collection, Iterator, Sequence
+import json
+import os
+import shutil
+import sys
+from typing import TYPE_CHECKING
+import numpy as np
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+type Column = np.ndarray | list
+
+
+def _is_number(v) -> bool:
+    return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+
+def _dtype(values: list) -> type | None:
+    """Numpy dtype that can hold all values exactly, None if they aren't all numbers"""
+    if not all(_is_number(v) for v in values):
+        return None
+    if all(isinstance(v, int) for v in values):
+        return np.int64 if all(-2**63 <= v < 2**63 for v in values) else None
+    return np.float64
+
+
+def _to_python(v):
+    return v.tolist() if isinstance(v, np.ndarray) else v.item() if isinstance(v, np.generic) else v
+
+
+class MessageTable(Sequence[dict]):
+    """
+    Columnar storage for all messages of a single FIT message type.
+
+    Each field is stored as one of
+    - scalar: 1d numpy array with one value per message
+    - list: flat numpy array of all values plus an offsets array (values of message i are values[offsets[i]:offsets[i+1]])
+    - json: python list, used for strings and anything else that isn't numeric
+
+    Fields missing from some messages have a boolean mask of which messages contain them.
+    Indexing or iterating materializes messages as dicts, same as the decoder output.
+    """
+
+    def __init__(self, length: int, columns: dict[str, dict]):
+        self.length = length
+        self.columns = columns
+
+    @classmethod
+    def from_records(cls, records: list[dict]) -> "MessageTable":
+        keys = list(dict.fromkeys(k for r in records for k in r))
+        columns = {}
+        for key in keys:
+            present = np.array([key in r and r[key] is not None for r in records], dtype=bool)
+            values = [r[key] for r in records if key in r and r[key] is not None]
+            flat = [x for v in values if isinstance(v, (list, tuple)) for x in v]
+            column: dict = {}
+            if (dtype := _dtype(values)) is not None:
+                filled = np.zeros(len(records), dtype=dtype)
+                filled[present] = values
+                column = {'kind': 'scalar', 'values': filled}
+            elif all(isinstance(v, (list, tuple)) for v in values) and (dtype := _dtype(flat)) is not None:
+                lengths = np.zeros(len(records), dtype=np.int64)
+                lengths[present] = [len(v) for v in values]
+                column = {
+                    'kind': 'list',
+                    'values': np.array(flat, dtype=dtype),
+                    'offsets': np.concatenate([[0], np.cumsum(lengths)]),
+                }
+            else:
+                column = {'kind': 'json', 'values': [r.get(key) for r in records]}
+            if not present.all():
+                column['mask'] = present
+            columns[key] = column
+        return cls(len(records), columns)
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, index): # type: ignore[override]
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.length))]
+        if index < 0: index += self.length
+        if not 0 <= index < self.length: raise IndexError(index)
+
+        row = {}
+        for key, column in self.columns.items():
+            if 'mask' in column and not column['mask'][index]:
+                continue
+            if column['kind'] == 'list':
+                offsets = column['offsets']
+                row[key] = column['values'][offsets[index]:offsets[index + 1]].tolist()
+            else:
+                row[key] = _to_python(column['values'][index])
+        return row
+
+    def __iter__(self) -> Iterator[dict]:
+        return (self[i] for i in range(self.length))
+
+    def has_field(self, name: str) -> bool:
+        return name in self.columns
+
+    def column(self, name: str) -> Column:
+        """Returns per-message values of a field. List fields return the flat values, see `list_lengths`."""
+        return self.columns[name]['values']
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Estimated size of the table's values. Memory mapped arrays count in full,
+        though only the parts that get used are read into memory.
+        """
+        total = 0
+        for column in self.columns.values():
+            for part in ('values', 'offsets', 'mask'):
+                if part not in column: continue
+                if isinstance(column[part], np.ndarray):
+                    total += column[part].nbytes
+                else:
+                    total += sys.getsizeof(column[part]) + sum(sys.getsizeof(v) for v in column[part])
+        return total
+
+    def list_lengths(self, name: str) -> np.ndarray:
+        """Number of values each message has for a list field"""
+        return np.diff(self.columns[name]['offsets'])
+
+    def to_frame(self) -> "pd.DataFrame":
+        """DataFrame with one row per message. List fields become object columns of arrays."""
+        import pandas as pd
+        data = {}
+        for key, column in self.columns.items():
+            if column['kind'] == 'list':
+                offsets = column['offsets']
+                series = pd.Series(np.split(np.asarray(column['values']), offsets[1:-1]), dtype=object)
+            else:
+                series = pd.Series(column['values'])
+            if 'mask' in column:
+                series = series.where(column['mask'])
+            data[key] = series
+        return pd.DataFrame(data, index=pd.RangeIndex(self.length))
+
+
+def write_tables(path: str, tables: dict[str, MessageTable], meta: dict):
+    """
+    Writes tables to a directory of .npy files with a meta.json manifest.
+    Written to a temporary directory first so readers never see a partial cache.
+    If another process already wrote tables with the same meta to path, those are kept.
+    """
+    tmp_path = f'{path}.tmp{os.getpid()}'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    manifest: dict = {'meta': meta, 'tables': {}}
+    for name, table in tables.items():
+        table_manifest = {'length': len(table), 'columns': {}}
+        for key, column in table.columns.items():
+            column_manifest: dict = {'kind': column['kind']}
+            for part in ('values', 'offsets', 'mask'):
+                if part not in column: continue
+                if part == 'values' and column['kind'] == 'json':
+                    column_manifest['values'] = column['values']
+                    continue
+                file_name = f'{name}.{key}.{part}.npy'
+                np.save(os.path.join(tmp_path, file_name), column[part], allow_pickle=False)
+                column_manifest[part] = file_name
+            table_manifest['columns'][key] = column_manifest
+        manifest['tables'][name] = table_manifest
+
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump(manifest, f, default=str)
+
+    try:
+        os.replace(tmp_path, path)
+        return
+    except OSError:
+        # path isn't empty, renaming over it fails rather than replacing files a reader may be using
+        pass
+    existing = read_meta(path)
+    if existing is None or existing['meta'] != meta:
+        # outdated or unreadable, nothing current can be reading it
+        shutil.rmtree(path, ignore_errors=True)
+        try:
+            os.replace(tmp_path, path)
+            return
+        except OSError:
+            # another process wrote it in between
+            pass
+    # already written by another process, its tables are as good as these
+    shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def read_meta(path: str) -> dict | None:
+    try:
+        with open(os.path.join(path, 'meta.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def read_tables(path: str, manifest: dict, names: Collection[str] | None = None) -> dict[str, MessageTable]:
+    """
+    Reads tables written by `write_tables`, only the ones in names if it's given.
+    Arrays are memory mapped rather than loaded.
+    """
+    tables = {}
+    for name, table_manifest in manifest['tables'].items():
+        if names is not None and name not in names: continue
+        columns = {}
+        for key, column_manifest in table_manifest['columns'].items():
+            column: dict = {'kind': column_manifest['kind']}
+            for part in ('values', 'offsets', 'mask'):
+                if part not in column_manifest: continue
+                if part == 'values' and column['kind'] == 'json':
+                    column['values'] = column_manifest['values']
+                else:
+                    column[part] = np.load(os.path.join(path, column_manifest[part]), mmap_mode='r')
+            columns[key] = column
+        tables[name] = MessageTable(table_manifest['length'], columns)
+    return tables
@@ -0,0 +1,105 @@
+"""
+Rolls resampled onto distance along the course, so any number of them can be overlaid
+and compared at the same points of the course rather than the same times.
+
+Each roll's track (elapsed time, speed and energy every TRACK_STEP_M m along the course) is
+calculated from its channels in an analytics worker and cached, then `compare_tracks`
+slices and diffs the cached tracks with array operations.
+"""
+import os
+import numpy as np
+from lib.cache import ResponseCache
+from lib.channels import roll_channels
+from lib.fit import DATA_PATH, fit_source_info
+from lib.series import Series, encode_graphs, to_series
+
+# bump when the contents of tracks change to invalidate cached tracks
+TRACK_VERSION = 1
+# spacing (in m) of the distance grid tracks are resampled onto
+TRACK_STEP_M = 1.0
+# gps points further than this (in m) from the course are left out of tracks
+TRACK_MAX_OFFSET_M = 25.0
+TRACK_CHANNELS = ('gps', 'course_projection', 'distance', 'speed', 'energy')
+
+tracks_cache = ResponseCache(f'{DATA_PATH}/cache/tracks', int(os.getenv('TRACKS_CACHE_BYTES', 64 * 2**20)))
+
+def track_cache_key(roll_id: int, fit_file: str, start_ms: int | None, end_ms: int | None) -> tuple:
+    """Cache key for a roll's track, changes when the FIT file is replaced or the roll's start or end moves"""
+    source = fit_source_info(fit_file)
+    return (roll_id, fit_file, source['mtime_ns'], source['size'], start_ms, end_ms, TRACK_VERSION)
+
+def track_window(roll_events) -> tuple[int | None, int | None]:
+    """Start and end (ms) of a roll's track, from its roll_start and roll_end events if there's exactly one of each"""
+    roll_starts = [e.timestamp_ms for e in roll_events if e.type == 'roll_start']
+    roll_ends = [e.timestamp_ms for e in roll_events if e.type == 'roll_end']
+    return (roll_starts[0] if len(roll_starts) == 1 else None,
+            roll_ends[0] if len(roll_ends) == 1 else None)
+
+def calculate_track(fit_file: str, start_ms: int | None, end_ms: int | None) -> Series | None:
+    """
+    Elapsed time (ms since start_ms, or the first gps point), speed and energy at each point of the
+    distance grid between start_ms and end_ms. Points of the grid the roll didn't reach are NaN.
+    None if the FIT file has no gps data.
+    """
+    from lib.geo import load_course_index
+
+    channels = roll_channels(fit_file, TRACK_CHANNELS)
+    gps_data = channels['gps']
+    if gps_data is None:
+        return None
+    timestamps = gps_data.index.to_numpy()
+    window = channels['course_projection'].offset <= TRACK_MAX_OFFSET_M
+    if start_ms is not None: window &= timestamps >= start_ms
+    if end_ms is not None: window &= timestamps <= end_ms
+
+    distance = channels['distance'].to_numpy()[window]
+    timestamps = timestamps[window]
+    # first time the roll got to each distance, so gps jitter backwards doesn't count twice
+    reached = np.concatenate([[True], distance[1:] > np.maximum.accumulate(distance)[:-1]]) if len(distance) else np.zeros(0, dtype=bool)
+    distance = distance[reached]
+
+    grid = np.arange(0, load_course_index().length, TRACK_STEP_M)
+    def resample(values: np.ndarray) -> np.ndarray:
+        if len(distance) == 0:
+            return np.full(len(grid), np.nan)
+        return np.interp(grid, distance, values[reached].astype(np.float64), left=np.nan, right=np.nan)
+
+    start = start_ms if start_ms is not None else (timestamps[0] if len(timestamps) else 0)
+    return to_series({
+        'distance': grid,
+        'elapsed_ms': resample(timestamps - start),
+        'speed': resample(channels['speed'].to_numpy()[window]),
+        'energy': resample(channels['energy'].to_numpy()[window]),
+    })
+
+def load_roll_track(fit_file: str, start_ms: int | None, end_ms: int | None) -> bytes:
+    """Track of a roll encoded with `encode_graphs`, as {'track': series} or {} without gps data"""
+    track = calculate_track(fit_file, start_ms, end_ms)
+    return encode_graphs({} if track is None else {'track': track})
+
+def compare_tracks(tracks: list[Series | None], reference: int, step: int = 1,
+                   start_m: float | None = None, end_m: float | None = None) -> dict:
+    """
+    Aligns tracks on their shared distance grid, every step points between start_m and end_m,
+    with each track's time delta (ms) against tracks[reference]. Positive deltas are behind the reference.
+    """
+    grid = next((track['distance'] for track in tracks if track is not None), np.zeros(0))
+    first = 0 if start_m is None else int(np.searchsorted(grid, start_m, side='left'))
+    last = len(grid) if end_m is None else int(np.searchsorted(grid, end_m, side='right'))
+    points = slice(first, last, step)
+
+    def column(track: Series | None, name: str) -> np.ndarray | None:
+        # copied so the columns are contiguous (and no longer views into the cached tracks)
+        return None if track is None else np.ascontiguousarray(track[name][points])
+
+    reference_elapsed = column(tracks[reference], 'elapsed_ms')
+    aligned = []
+    for track in tracks:
+        elapsed = column(track, 'elapsed_ms')
+        aligned.append({
+            'elapsed_ms': elapsed,
+            'speed': column(track, 'speed'),
+            'energy': column(track, 'energy'),
+            'delta_ms': None if elapsed is None or reference_elapsed is None else elapsed - reference_elapsed,
+        })
+    return {'distance': np.ascontiguousarray(grid[points]), 'tracks': aligned}
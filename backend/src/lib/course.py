@@ -0,0 +1,82 @@
+from collections.abc import Callable
+from typing import NamedTuple
+
+import numpy as np
+import geopandas as gpd
+import shapely
+from pyproj import Transformer
+from scipy.spatial import cKDTree
+
+# spacing (in m) between vertices of the densified course line
+COURSE_SPACING = 1.0
+# number of nearest vertices whose segments are checked for each point
+COURSE_NEIGHBORS = 4
+
+class CourseProjection(NamedTuple):
+    """Points snapped to the course"""
+    long: np.ndarray
+    lat: np.ndarray
+    distance: np.ndarray
+    """distance along the course from the start (m)"""
+    offset: np.ndarray
+    """distance between the original point and the course (m)"""
+    elevation: np.ndarray
+    """elevation at the snapped point (m)"""
+
+class CourseIndex:
+    """
+    Course line densified into a metric polyline, with a KD-tree over its vertices
+    for snapping many gps points to the course at once.
+    """
+
+    def __init__(self, line: shapely.LineString | shapely.MultiLineString,
+                 sample_elevation: Callable[[np.ndarray, np.ndarray], np.ndarray]):
+        line = shapely.force_2d(line)
+        if isinstance(line, shapely.MultiLineString):
+            line = shapely.line_merge(line)
+        crs = gpd.GeoSeries([line], crs='epsg:4326').estimate_utm_crs()
+        self.to_projected = Transformer.from_crs('epsg:4326', crs, always_xy=True)
+        self.to_lonlat = Transformer.from_crs(crs, 'epsg:4326', always_xy=True)
+        self.sample_elevation = sample_elevation
+
+        long, lat = shapely.get_coordinates(line).T
+        xy = np.column_stack(self.to_projected.transform(long, lat))
+        self.xy = shapely.get_coordinates(shapely.segmentize(shapely.linestrings(xy), COURSE_SPACING))
+        self.distance = np.concatenate([[0], np.cumsum(np.linalg.norm(np.diff(self.xy, axis=0), axis=1))])
+        self.length = float(self.distance[-1])
+        self.tree = cKDTree(self.xy)
+
+    def project(self, long: np.ndarray, lat: np.ndarray) -> CourseProjection:
+        """Snaps gps points (in degrees) to the nearest point on the course"""
+        points = np.column_stack(self.to_projected.transform(np.asarray(long, dtype=float), np.asarray(lat, dtype=float)))
+        if len(points) == 0:
+            empty = np.zeros(0)
+            return CourseProjection(empty, empty, empty, empty, np.asarray(self.sample_elevation(empty, empty)))
+
+        k = min(COURSE_NEIGHBORS, len(self.xy))
+        _, vertices = self.tree.query(points, k=k)
+        vertices = np.asarray(vertices).reshape(len(points), k)
+        # candidate segments start at each nearby vertex and the one before it
+        starts = np.clip(np.concatenate([vertices - 1, vertices], axis=1), 0, len(self.xy) - 2)
+
+        a = self.xy[starts]
+        ab = self.xy[starts + 1] - a
+        ap = points[:, None, :] - a
+        t = np.clip(np.sum(ap * ab, axis=2) / np.maximum(np.sum(ab * ab, axis=2), 1e-12), 0, 1)
+        snapped = a + t[..., None] * ab
+        offsets = np.linalg.norm(points[:, None, :] - snapped, axis=2)
+
+        best = np.argmin(offsets, axis=1)
+        rows = np.arange(len(points))
+        segment = starts[rows, best]
+        snapped = snapped[rows, best]
+        distance = self.distance[segment] + t[rows, best] * (self.distance[segment + 1] - self.distance[segment])
+
+        snapped_long, snapped_lat = self.to_lonlat.transform(snapped[:, 0], snapped[:, 1])
+        return CourseProjection(
+            long=np.asarray(snapped_long),
+            lat=np.asarray(snapped_lat),
+            distance=distance,
+            offset=offsets[rows, best],
+            elevation=self.sample_elevation(snapped_long, snapped_lat),
+        )
@@ -0,0 +1,113 @@
+from collections.abc import Callable, Hashable, Iterable
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import os
+import threading
+from lib.metrics import Recorder, current, merge, run_recorded
+
+# number of processes used for heavy analytics (FIT decoding, graphs, stats)
+ANALYTICS_WORKERS = int(os.getenv('ANALYTICS_WORKERS', 2))
+
+class AnalyticsJob[T](Future[T]):
+    """Result of a job on the analytics pool, with the spans the worker recorded while running it"""
+
+    def __init__(self):
+        super().__init__()
+        self.recorder = Recorder()
+
+class AnalyticsExecutor:
+    """
+    Runs CPU heavy jobs in a bounded pool of processes, so they don't hold the API's GIL.
+    Jobs submitted with the same key while one is already running share its result.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        # run by each worker when it starts, e.g. to load data ahead of the first job
+        self.initializer: Callable[[], None] | None = None
+        self.pool: ProcessPoolExecutor | None = None
+        self.in_flight: dict[Hashable, AnalyticsJob] = {}
+        self.submitted = 0
+        self.coalesced = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self.pool is None:
+            # spawn, since forking the threaded server process isn't safe
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=self.initializer)
+        return self.pool
+
+    def start(self, initializer: Callable[[], None] | None = None):
+        """Starts all workers now rather than on the first jobs, running initializer in each as it starts"""
+        with self.lock:
+            self.initializer = initializer
+            pool = self._get_pool()
+            # workers are started on demand, one per job that finds no idle worker
+            for _ in range(self.workers):
+                pool.submit(int)
+
+    def submit[T](self, key: Hashable, fn: Callable[..., T], *args) -> AnalyticsJob[T]:
+        with self.lock:
+            if key in self.in_flight:
+                self.coalesced += 1
+                return self.in_flight[key]
+            try:
+                future = self._get_pool().submit(run_recorded, fn, *args)
+            except BrokenProcessPool:
+                # a worker died (e.g. out of memory), start a new pool
+                self.pool = None
+                future = self._get_pool().submit(run_recorded, fn, *args)
+            self.submitted += 1
+            job = AnalyticsJob[T]()
+            job.set_running_or_notify_cancel()
+            self.in_flight[key] = job
+        future.add_done_callback(lambda f: self._done(key, f, job))
+        return job
+
+    def _done(self, key: Hashable, future: Future, job: AnalyticsJob):
+        try:
+            result, job.recorder = future.result()
+        except BaseException as e:
+            with self.lock:
+                self.failed += 1
+                del self.in_flight[key]
+            job.set_exception(e)
+            return
+        merge(job.recorder)
+        with self.lock:
+            del self.in_flight[key]
+        job.set_result(result)
+
+    def run[T](self, key: Hashable, fn: Callable[..., T], *args) -> T:
+        """Submits a job (or joins a running one with the same key) and waits for the result"""
+        return self.run_many([(key, fn, args)])[0]
+
+    def run_many(self, jobs: Iterable[tuple[Hashable, Callable, tuple]], return_exceptions: bool = False) -> list:
+        """
+        Submits (key, fn, args) jobs at once, so they run in parallel, and waits for all their results.
+        With return_exceptions a failed job's exception is returned as its result instead of raised.
+        """
+        submitted = [self.submit(key, fn, *args) for key, fn, args in jobs]
+        results = [job.exception() or job.result() if return_exceptions else job.result() for job in submitted]
+        # the workers' spans are part of the time this request spent waiting
+        recorder = current.get()
+        if recorder is not None:
+            for job in submitted:
+                recorder.spans += job.recorder.spans
+        return results
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'workers': self.workers,
+                'in_flight': len(self.in_flight),
+                'queued': max(0, len(self.in_flight) - self.workers),
+                'submitted': self.submitted,
+                'coalesced': self.coalesced,
+                'failed': self.failed,
+            }
+
+analytics = AnalyticsExecutor(ANALYTICS_WORKERS)
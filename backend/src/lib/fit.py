@@ -1,38 +1,88 @@
-from garmin_fit_sdk import Decoder, Stream
-from lib.signal import unfiorm_sample
-import pandas as pd
+from lib.cache import MemoryCache
+from lib.columnar import MessageTable, read_meta, read_tables, write_tables
+from lib.metrics import inc, set_gauge, span
 import numpy as np
-from scipy import signal
-import orjson
-import json
-from functools import lru_cache
-from typing import List, TypedDict
+from collections.abc import Collection
+from typing import TYPE_CHECKING, List, TypedDict
 import os
 
+# pandas, scipy and the FIT SDK are imported where they're used, so the API starts
+# without them and they're only loaded by the processes that do analytics
+if TYPE_CHECKING:
+    import pandas as pd
+
 FIT_EPOCH_S = 631065600
 DATA_PATH = os.getenv('DATA_PATH', '/app/data')
+# bump when decoding or the cache layout changes to invalidate existing caches
+FIT_CACHE_VERSION = 1
+
+type FitMessages = dict[str, MessageTable]
+
+# budget for FIT messages held in memory by each process, by their estimated size
+FIT_MEMORY_BYTES = int(os.getenv('FIT_MEMORY_BYTES', 512 * 2**20))
+fit_messages = MemoryCache[FitMessages](FIT_MEMORY_BYTES, lambda messages: sum(t.nbytes for t in messages.values()))
+
+def fit_cache_path(rel_path: str) -> str:
+    return f'{DATA_PATH}/cache/fit/{rel_path.replace("/", "_").replace(".fit", "")}'
 
-type FitMessages = dict[str, list[dict]]
+def fit_source_info(rel_path: str) -> dict:
+    """Identifies the version of a FIT file on disk, used to invalidate caches when it changes"""
+    stat = os.stat(f'{DATA_PATH}/{rel_path}')
+    return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
 
-@lru_cache(maxsize=16)
-def load_fit_file(file_path: str) -> FitMessages:
-    rel_path = file_path
-    if file_path.startswith(DATA_PATH):
-        rel_path = file_path[len(DATA_PATH)+1:]
-    
-    try:
-        with open(f'{DATA_PATH}/cache/{rel_path.replace("/", "_").replace('.fit', '')}.json', 'r') as f:
-            messages = orjson.loads(f.read())
-    except Exception as e:
+def fit_identity(file_path: str) -> tuple[str, int, int]:
+    """(path relative to DATA_PATH, mtime_ns, size) of a FIT file, changes when the file is replaced"""
+    rel_path = file_path.removeprefix(f'{DATA_PATH}/')
+    source = fit_source_info(rel_path)
+    return (rel_path, source['mtime_ns'], source['size'])
+
+def load_fit_file(file_path: str, message_types: Collection[str] | None = None) -> FitMessages:
+    """
+    Loads messages from a FIT file, using a columnar cache in data/cache/fit when it's up to date.
+    Cached arrays are memory mapped, so only the fields that get used are read from disk.
+    If message_types is given only those types are loaded (e.g. to skip the high rate sensor data).
+    """
+    types = None if message_types is None else frozenset(message_types)
+    # keyed on the file's mtime and size too, so a replaced file isn't served from memory
+    key = (*fit_identity(file_path), types)
+    messages = fit_messages.get(key)
+    if messages is not None:
+        inc('srs_fit_cache_total', result='memory')
+    else:
+        # messages from an older version of the file won't be used again
+        fit_messages.invalidate(key[0], keep=key[1:3])
+        messages = _load_fit_file(*key)
+        fit_messages.put(key, messages)
+    stats = fit_messages.stats()
+    set_gauge('srs_fit_memory_bytes', stats['bytes'], worker=str(os.getpid()))
+    set_gauge('srs_fit_memory_entries', stats['entries'], worker=str(os.getpid()))
+    return messages
+
+def _load_fit_file(rel_path: str, mtime_ns: int, size: int, message_types: frozenset[str] | None) -> FitMessages:
+    cache_path = fit_cache_path(rel_path)
+    meta = {'version': FIT_CACHE_VERSION, 'source': {'mtime_ns': mtime_ns, 'size': size}}
+    manifest = read_meta(cache_path)
+    if manifest is not None and manifest['meta'] == meta:
+        inc('srs_fit_cache_total', result='disk')
+        with span('fit_cache_read'):
+            return read_tables(cache_path, manifest, message_types)
+    
+    # the SDK can't skip message types, so the whole file is decoded and cached once
+    # and later loads of any message types read from the cache
+    inc('srs_fit_cache_total', result='decode')
+    from garmin_fit_sdk import Decoder, Stream
+    with span('fit_decode'):
         stream = Stream.from_file(f'{DATA_PATH}/{rel_path}')
         decoder = Decoder(stream)
         messages, errors = decoder.read(convert_datetimes_to_dates=False)
-        if errors: raise ValueError(f"Errors encountered while decoding FIT file: {errors}")
-        print(f'Caching {rel_path.replace("/", "_").replace('.fit', '')}.json')
-        with open(f'{DATA_PATH}/cache/{rel_path.replace("/", "_").replace('.fit', '')}.json', 'w') as f:
-            json.dump(messages, f, default=str)
+    if errors: raise ValueError(f"Errors encountered while decoding FIT file: {errors}")
     
-    return messages
+    print(f'Caching {cache_path}')
+    with span('fit_cache_write'):
+        tables = {name: MessageTable.from_records(records) for name, records in messages.items()}
+        write_tables(cache_path, tables, meta)
+    with span('fit_cache_read'):
+        return read_tables(cache_path, read_meta(cache_path), message_types) # type: ignore
 
 def get_camera_starts(messages: FitMessages) -> list[int]:
     """
@@ -48,7 +98,7 @@ def get_camera_ends(messages: FitMessages) -> list[int]:
     return [m['timestamp'] * 1000 + m['timestamp_ms']
               for m in messages.get('camera_event_mesgs', []) if m.get('camera_event_type', '') == 'video_end']
     
-def get_gps_data(messages: FitMessages) -> pd.DataFrame | None:
+def get_gps_data(messages: FitMessages) -> "pd.DataFrame | None":
     """
     Get gps data from fit file messagges.
     Returns None if no gps data present. Else dataframe with these columns
@@ -64,8 +114,8 @@ def get_gps_data(messages: FitMessages) -> pd.DataFrame | None:
     if 'gps_metadata_mesgs' not in messages:
         return None
     
-    gps_mesgs = messages['gps_metadata_mesgs']
-    gps_data = pd.DataFrame.from_records(gps_mesgs)
+    import pandas as pd
+    gps_data = messages['gps_metadata_mesgs'].to_frame()
     gps_data.position_lat = gps_data.position_lat / 2**31 * 180
     gps_data.position_long = gps_data.position_long / 2**31 * 180        
     gps_data.utc_timestamp = pd.to_datetime((gps_data.utc_timestamp + FIT_EPOCH_S) * 1e9)
@@ -84,44 +134,51 @@ class SensorMessage(TypedDict):
     
     
 # TODO: handle multiple calibration messages (for gyro)
-def get_sensor_data(calibration: dict, sensor_messages: List[SensorMessage], fields: dict[str, str], decimation: int = 1) \
-    -> tuple[pd.DataFrame, pd.DataFrame, float]:
-    # note: can be made ~30% faster by using lists instead of dicts for constructing raw
-    raw_list = []
-    for group in sensor_messages:
-        base_timestamp = group['timestamp'] * 1000 + group['timestamp_ms']
-        for i, offset in enumerate(group['sample_time_offset']):
-            entry = {
-                'timestamp': base_timestamp + offset,
-            } | {key: group[name][i] for key, name in fields.items()}
-            raw_list.append(entry)
-    raw = pd.DataFrame.from_records(raw_list)
-    raw = raw.set_index('timestamp').sort_index()
-    raw.index = raw.index 
-    
-    data = np.array(calibration['orientation_matrix']).reshape(3, 3) @ ((raw.to_numpy() \
-    - calibration['level_shift'] - calibration['offset_cal']) * \
-    (calibration['calibration_factor'] / calibration['calibration_divisor'])).T
-    data = pd.DataFrame(data.T, columns=list(fields.keys()), index=raw.index)
+def get_sensor_data(calibration: dict, sensor_messages: MessageTable | List[SensorMessage], fields: dict[str, str], decimation: int = 1) \
+    -> "tuple[pd.DataFrame, pd.DataFrame, float]":
+    import pandas as pd
+    from scipy import signal
+    from lib.signal import unfiorm_sample
+    
+    if not isinstance(sensor_messages, MessageTable):
+        sensor_messages = MessageTable.from_records(sensor_messages) # type: ignore
+    
+    # each message holds a batch of samples, flatten them using the per message sample counts
+    counts = sensor_messages.list_lengths('sample_time_offset')
+    base_timestamps = np.asarray(sensor_messages.column('timestamp')) * 1000 + np.asarray(sensor_messages.column('timestamp_ms'))
+    timestamps = np.repeat(base_timestamps, counts) + np.asarray(sensor_messages.column('sample_time_offset'))
+    values = np.column_stack([np.asarray(sensor_messages.column(name)) for name in fields.values()])
+    
+    order = np.argsort(timestamps, kind='stable')
+    index = pd.Index(timestamps[order], name='timestamp')
+    raw = pd.DataFrame(values[order], columns=list(fields.keys()), index=index)
+    
+    with span('calibration'):
+        data = np.array(calibration['orientation_matrix']).reshape(3, 3) @ ((raw.to_numpy() \
+        - calibration['level_shift'] - calibration['offset_cal']) * \
+        (calibration['calibration_factor'] / calibration['calibration_divisor'])).T
+        data = pd.DataFrame(data.T, columns=list(fields.keys()), index=raw.index)
     fs = 1000 / np.median(np.diff(data.index))
     
     if decimation > 1:
-        uniform_data = unfiorm_sample(data)
-        decimated_data = signal.decimate(uniform_data.to_numpy().T, decimation).T
-        data = pd.DataFrame(decimated_data, columns=list(fields.keys()),
-                            index=uniform_data.index[::decimation])
+        with span('decimation'):
+            uniform_data = unfiorm_sample(data)
+            decimated_data = signal.decimate(uniform_data.to_numpy().T, decimation).T
+            data = pd.DataFrame(decimated_data, columns=list(fields.keys()),
+                                index=uniform_data.index[::decimation])
         fs = fs / decimation
     
     data['timestamp'] = data.index
     return raw, data, float(fs)
 
 
-def get_angular_velocity(gps_data: pd.DataFrame, cutoff: float = 2.0) -> pd.Series:
+def get_angular_velocity(gps_data: "pd.DataFrame", cutoff: float = 2.0) -> "pd.Series":
     """
     Compute angular velocity (in rad/s) from gps heading data.
     Returns pd.Series indexed by timestamp (ms).
     Filters out data where speed < cutoff
     """
+    import pandas as pd
     
     heading = gps_data.heading[np.linalg.norm(np.array(gps_data.velocity.to_list()), axis=1) >= cutoff]
     # Account for wrap arounds
@@ -1,12 +1,20 @@
 from functools import lru_cache
 
+import numpy as np
 import pandas as pd
 import rasterio
+from rasterio.transform import rowcol
+from rasterio.windows import Window, from_bounds
 import geopandas as gpd
-from shapely.ops import nearest_points
+from pyproj import Transformer
+from lib.course import CourseIndex
 import os
 
 DATA_PATH = os.getenv('DATA_PATH', '/app/data')
+# area around the course (in raster units, m) kept in memory for elevation lookups
+ELEVATION_MARGIN = 250
+# elevation (m) of the start line, elevations are given relative to it
+START_LINE_ELEVATION = 288.4
 
 @lru_cache(maxsize=1)
 def load_elevation_data() -> rasterio.DatasetReader:
@@ -16,13 +24,81 @@ def load_elevation_data() -> rasterio.DatasetReader:
 def load_course() -> gpd.GeoSeries:
     return gpd.read_file(f'{DATA_PATH}/geo/course.kml').geometry
 
+class ElevationGrid:
+    """
+    Elevation raster around the course held in memory, for looking up many points at once.
+    Points outside of the loaded area fall back to reading from the raster file.
+    """
+
+    def __init__(self, dataset: rasterio.DatasetReader, bounds: tuple[float, float, float, float]):
+        self.dataset = dataset
+        self.transformer = Transformer.from_crs('epsg:4326', dataset.crs, always_xy=True)
+        self.fill = np.array(dataset.nodata or 0, dtype=dataset.dtypes[0])
+
+        left, bottom, right, top = self.transformer.transform_bounds(*bounds)
+        window = from_bounds(left - ELEVATION_MARGIN, bottom - ELEVATION_MARGIN,
+                             right + ELEVATION_MARGIN, top + ELEVATION_MARGIN, dataset.transform)
+        window = window.round_offsets().round_lengths().intersection(Window(0, 0, dataset.width, dataset.height))
+        self.row_off, self.col_off = int(window.row_off), int(window.col_off)
+        self.data = dataset.read(1, window=window)
+
+    def sample(self, long: np.ndarray, lat: np.ndarray, interpolate: bool = False) -> np.ndarray:
+        """
+        Elevations at gps coordinates (in degrees).
+        By default uses the value of the pixel containing each point, same as rasterio's sample.
+        With interpolate, values are bilinearly interpolated between pixel centers.
+        """
+        xs, ys = self.transformer.transform(np.asarray(long, dtype=float), np.asarray(lat, dtype=float))
+        rows, cols = rowcol(self.dataset.transform, xs, ys)
+        rows = np.asarray(rows, dtype=np.int64) - self.row_off
+        cols = np.asarray(cols, dtype=np.int64) - self.col_off
+        inside = (rows >= 0) & (rows < self.data.shape[0]) & (cols >= 0) & (cols < self.data.shape[1])
+
+        elevations = np.full(len(xs), self.fill, dtype=self.data.dtype)
+        elevations[inside] = self.data[rows[inside], cols[inside]]
+        if not inside.all():
+            outside = np.flatnonzero(~inside)
+            samples = self.dataset.sample(zip(xs[outside], ys[outside]))
+            elevations[outside] = [e[0] for e in samples]
+
+        if interpolate:
+            elevations = elevations.astype(np.float64)
+            self._interpolate(xs, ys, elevations)
+        return elevations
+
+    def _interpolate(self, xs: np.ndarray, ys: np.ndarray, out: np.ndarray):
+        """Bilinear interpolation for points whose four surrounding pixel centers are loaded, written to out"""
+        fcols, frows = ~self.dataset.transform * (xs, ys)
+        frows = np.asarray(frows) - self.row_off - 0.5
+        fcols = np.asarray(fcols) - self.col_off - 0.5
+        rows, cols = np.floor(frows).astype(np.int64), np.floor(fcols).astype(np.int64)
+        valid = (rows >= 0) & (rows < self.data.shape[0] - 1) & (cols >= 0) & (cols < self.data.shape[1] - 1)
+
+        rows, cols = rows[valid], cols[valid]
+        dr, dc = frows[valid] - rows, fcols[valid] - cols
+        top = self.data[rows, cols] * (1 - dc) + self.data[rows, cols + 1] * dc
+        bottom = self.data[rows + 1, cols] * (1 - dc) + self.data[rows + 1, cols + 1] * dc
+        out[valid] = top * (1 - dr) + bottom * dr
+
+@lru_cache(maxsize=1)
+def load_elevation_grid() -> ElevationGrid:
+    return ElevationGrid(load_elevation_data(), tuple(load_course().total_bounds))
+
+@lru_cache(maxsize=1)
+def load_course_index() -> CourseIndex:
+    return CourseIndex(load_course()[0], load_elevation_grid().sample)
+
 # TODO: snap to bounding box instead of line
-def get_elevations(gps_data: pd.DataFrame, snap_to_course: bool, subtract_start_line: bool) -> pd.Series:
-    positions = gpd.GeoSeries(gpd.points_from_xy(gps_data.position_long, gps_data.position_lat), crs='epsg:4326')
+def get_elevations(gps_data: pd.DataFrame, snap_to_course: bool, subtract_start_line: bool,
+                   interpolate: bool = False) -> pd.Series:
+    long, lat = gps_data.position_long.to_numpy(), gps_data.position_lat.to_numpy()
     if snap_to_course:
-        course = load_course()
-        positions = gpd.GeoSeries(nearest_points(course[0], positions.values)[0], crs="epsg:4326") # type: ignore
-    
-    elevation = load_elevation_data()
-    samples = elevation.sample(positions.to_crs(elevation.crs).apply(lambda p: (p.x, p.y)))
-    return pd.Series([e[0] for e in samples], index=gps_data.index) - (288.4 if subtract_start_line else 0.0)
+        projection = load_course_index().project(long, lat)
+        long, lat = projection.long, projection.lat
+
+    if snap_to_course and not interpolate:
+        # projecting already sampled the grid at the snapped points
+        elevations = projection.elevation
+    else:
+        elevations = load_elevation_grid().sample(long, lat, interpolate)
+    return pd.Series(elevations, index=gps_data.index) - (START_LINE_ELEVATION if subtract_start_line else 0.0)
@@ -0,0 +1,60 @@
+from lib.cache import ResponseCache
+from lib.channels import RollChannels, roll_channels
+from lib.fit import DATA_PATH, fit_source_info
+from lib.metrics import span
+from lib.series import encode_graphs, to_series
+import os
+
+# bump when the contents of the graphs response change to invalidate cached responses
+GRAPHS_VERSION = 3
+SENSOR_CHANNELS = ('accelerometer', 'gyroscope', 'magnetometer')
+# channels used for graphs
+GRAPHS_CHANNELS = ('gps', 'elevation', 'speed', 'centripetal', *SENSOR_CHANNELS, 'camera_starts', 'camera_ends')
+
+graphs_cache = ResponseCache(f'{DATA_PATH}/cache/graphs', int(os.getenv('GRAPHS_CACHE_BYTES', 256 * 2**20)))
+
+def graphs_cache_key(roll_id: int, fit_file: str) -> tuple:
+    """Cache key for a roll's graphs, changes when the FIT file is replaced"""
+    source = fit_source_info(fit_file)
+    return (roll_id, fit_file, source['mtime_ns'], source['size'], GRAPHS_VERSION)
+
+def load_roll_graphs(fit_file: str) -> bytes:
+    """Calculates graph data for a FIT file, encoded with `encode_graphs`"""
+    graphs = calculate_roll_graphs(roll_channels(fit_file, GRAPHS_CHANNELS))
+    with span('encode'):
+        return encode_graphs(graphs)
+
+def warm_worker():
+    """Loads the course and elevation raster in an analytics worker, ahead of its first graphs or stats job"""
+    from lib.geo import load_course_index
+    try:
+        load_course_index()
+    except Exception as e:
+        print(f"Error loading course: {e!r}")
+
+def calculate_roll_graphs(channels: RollChannels) -> dict:
+    # imported here so the API doesn't load it at startup, graphs are calculated in analytics workers
+    import pandas as pd
+    
+    response = {}
+    gps_data = channels['gps']
+    if gps_data is not None:
+        response['gps_data'] = to_series(pd.DataFrame({
+            'timestamp': gps_data.index,
+            'lat': gps_data.position_lat,
+            'long': gps_data.position_long,
+            'elevation': channels['elevation'],
+            'speed': channels['speed'],
+        }))
+        centripetal = channels['centripetal']
+        response['centripetal'] = to_series(pd.DataFrame({
+            'timestamp': centripetal.index,
+            'values': centripetal,
+        }))
+    
+    for sensor in SENSOR_CHANNELS:
+        if channels[sensor] is not None:
+            response[sensor] = to_series(channels[sensor])
+    response['camera_starts'] = channels['camera_starts']
+    response['camera_ends'] = channels['camera_ends']
+    return response
@@ -0,0 +1,90 @@
+"""
+Hill times aggregated in SQL, e.g. the fastest Hill 2 pushers of a season, without loading rolls.
+
+Hill times are calculated from rollevent like `calculate_hill_times`: each roll's segment
+events are pivoted into columns in one pass over idx_rollevent_roll_type_tag_timestamp,
+then unpivoted into (roll_id, hill_number, time_ms) rows to be grouped.
+"""
+from sqlalchemy import ColumnElement, Label, Select, and_, func, literal, select, union_all
+from sqlalchemy.orm import Session
+from db.database import Buggy, Driver, Pusher, Roll, RollDate, RollEvent, RollHill, RollType
+from lib.events import HILL_SEGMENTS
+
+# columns identifying each group, by what hill times can be grouped by
+HILL_GROUPS: dict[str, tuple[Label, ...]] = {
+    'pusher': (Pusher.id.label('pusher_id'), Pusher.name.label('pusher')),
+    'buggy': (Buggy.id.label('buggy_id'), Buggy.name.label('buggy')),
+    'driver': (Driver.id.label('driver_id'), Driver.name.label('driver')),
+    'date': (RollDate.id.label('roll_date_id'), RollDate.year.label('year'), RollDate.month.label('month'),
+             RollDate.day.label('day'), RollDate.type.label('roll_type')),
+}
+GROUP_RELATIONSHIPS = {'buggy': Roll.buggy, 'driver': Roll.driver, 'date': Roll.roll_date}
+# hills pushed by this "pusher" aren't counted towards pusher times
+MECH_PUSHER = 'MECH'
+
+def _is_event(event: tuple[str, str | None]) -> ColumnElement[bool]:
+    type, tag = event
+    return RollEvent.type == type if tag is None else and_(RollEvent.type == type, RollEvent.tag == tag)
+
+def hill_times_query(hills: list[int], rolls: Select | None = None) -> Select:
+    """(roll_id, hill_number, time_ms) of the given hills of every roll (or the rolls with ids selected by rolls) they're timed for"""
+    events = list(dict.fromkeys(event for hill in hills for event in HILL_SEGMENTS[hill]))
+    # the count and time of each segment event per roll, a hill is timed if both its events occur once
+    columns = []
+    for i, event in enumerate(events):
+        columns.append(func.count().filter(_is_event(event)).label(f'n{i}'))
+        columns.append(func.min(RollEvent.timestamp_ms).filter(_is_event(event)).label(f't{i}'))
+    query = select(RollEvent.roll_id, *columns) \
+        .where(RollEvent.type.in_({type for type, _ in events})).group_by(RollEvent.roll_id)
+    if rolls is not None:
+        query = query.where(RollEvent.roll_id.in_(rolls))
+    pivot = query.cte('segment_events')
+
+    def timed(hill: int) -> Select:
+        start, end = (events.index(event) for event in HILL_SEGMENTS[hill])
+        return select(
+            pivot.c.roll_id, literal(hill).label('hill_number'),
+            (pivot.c[f't{end}'] - pivot.c[f't{start}']).label('time_ms'),
+        ).where(pivot.c[f'n{start}'] == 1, pivot.c[f'n{end}'] == 1)
+    return union_all(*(timed(hill) for hill in hills))
+
+def hill_time_stats(session: Session, group_by: str, hills: list[int] | None = None, year: int | None = None,
+                    roll_type: RollType | None = None, min_count: int = 1) -> list[dict]:
+    """
+    Count, min, median and mean hill time (ms) per group and hill, ordered by hill then median.
+    Grouped by pusher, only the hills with a (non mech) pusher recorded are counted.
+    """
+    rolls = None
+    if year is not None or roll_type is not None:
+        rolls = select(Roll.id).join(Roll.roll_date)
+        if year is not None: rolls = rolls.where(RollDate.year == year)
+        if roll_type is not None: rolls = rolls.where(RollDate.type == roll_type)
+    times = hill_times_query(hills or list(HILL_SEGMENTS), rolls).subquery('hill_times')
+
+    keys = HILL_GROUPS[group_by]
+    # position of each time in its group, the median is the middle one (or the mean of the middle two)
+    partition = [keys[0].element, times.c.hill_number]
+    ranked = select(
+        *keys, times.c.hill_number, times.c.time_ms,
+        func.row_number().over(partition_by=partition, order_by=times.c.time_ms).label('time_rank'),
+        func.count().over(partition_by=partition).label('group_count'),
+    ).select_from(times)
+    if group_by == 'pusher':
+        ranked = ranked.join(RollHill, and_(RollHill.roll_id == times.c.roll_id, RollHill.hill_number == times.c.hill_number)) \
+            .join(RollHill.pusher).where(Pusher.name != MECH_PUSHER)
+    else:
+        ranked = ranked.join(Roll, Roll.id == times.c.roll_id).join(GROUP_RELATIONSHIPS[group_by])
+    ranked = ranked.subquery('ranked')
+
+    key_columns = [ranked.c[key.name] for key in keys]
+    median = func.avg(ranked.c.time_ms).filter(
+        ranked.c.time_rank.between((ranked.c.group_count + 1) // 2, (ranked.c.group_count + 2) // 2))
+    query = select(
+        *key_columns, ranked.c.hill_number,
+        func.count().label('count'),
+        func.min(ranked.c.time_ms).label('min_ms'),
+        median.label('median_ms'),
+        func.avg(ranked.c.time_ms).label('mean_ms'),
+    ).group_by(*key_columns, ranked.c.hill_number).having(func.count() >= min_count) \
+        .order_by(ranked.c.hill_number, median, key_columns[0])
+    return [dict(row) for row in session.execute(query).mappings()]
@@ -0,0 +1,246 @@
+"""
+Bulk import of VIRB rolls, replacing the reentry script in notebooks/load.ipynb.
+
+Rolls are found through VIRB Edit's database: each movie project is named
+<year>_<month>_<day>_<driver>_<buggy>_<roll number>[_crotch] and points, through its
+raw movie, at a FIT file (<sensor>/<start time>.fit) and a low resolution preview video.
+FIT files are expected in {DATA_PATH}/virbs/all and previews in {DATA_PATH}/videos/previews.
+
+Usage: srs-ingest "<...>/VIRB Edit/Database/7" [--roll-type weekend] [--workers 4]
+"""
+from argparse import ArgumentParser
+from datetime import datetime
+import glob
+import os
+import time
+from typing import NamedTuple
+import xml.etree.ElementTree as ET
+
+from db.database import engine, create_db_and_tables, Buggy, Driver, Roll, RollDate, RollEvent, RollFile, RollType, Sensor
+from lib.compare import load_roll_track, track_cache_key, track_window, tracks_cache
+from lib.executor import analytics
+from lib.fit import DATA_PATH
+from lib.graphs import graphs_cache, graphs_cache_key, load_roll_graphs
+from lib.maptrack import load_map_track, map_track_cache, map_track_cache_key
+from lib.stats import refresh_stale_roll_stats
+from sqlalchemy import insert, select, tuple_
+from sqlalchemy.orm import Session
+
+# names used in VIRB Edit projects that differ from the ones in the database
+DRIVER_NAMES = {'Meixi': 'Mei Xi'}
+BUGGY_NAMES = {'kp': 'Kingpin II'}
+# processes of the analytics pool while ingesting, which decode FIT files and calculate caches and stats
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', min(4, os.cpu_count() or 1)))
+# TODO: script to split large video files from broken rolls
+SKIPPED_PREVIEWS = {'7de890f8-fb7a-49aa-97a7-96eaf53a7a44.MP4'}
+
+class VirbRoll(NamedTuple):
+    """A roll recorded by one VIRB, as found in VIRB Edit"""
+    name: str
+    date: tuple[int, int, int]
+    driver: str
+    buggy: str
+    roll_number: int
+    start_time: datetime
+    sensor: str
+    fit_file: str
+    preview: str
+    video_type: str
+
+    @property
+    def fit_uri(self) -> str:
+        return f"[[fit]]/all/{self.fit_file}"
+
+    @property
+    def preview_uri(self) -> str:
+        return f"[[videos]]/previews/{self.preview}"
+
+def parse_project_name(name: str, fit_path: str, preview: str) -> VirbRoll:
+    sensor, fit_file = fit_path.replace('\\', '/').split('/')[-2:]
+    year, month, day, hour, minute, second = fit_file.split('.')[0].split('-')
+    parts = name.split('_')
+    video_type = "video_preview_c" if parts[-1] == "crotch" else "video_preview"
+    if parts[-1] == "crotch":
+        parts = parts[:-1]
+    return VirbRoll(
+        name=name,
+        date=(int(parts[0]), int(parts[1]), int(parts[2])),
+        driver=DRIVER_NAMES.get(parts[3], parts[3]),
+        buggy=parts[4],
+        roll_number=int(parts[-1]),
+        start_time=datetime.fromisoformat(f"{year}-{month}-{day}T{hour}:{minute}:{second}Z"),
+        sensor=sensor,
+        fit_file=fit_file,
+        preview=preview,
+        video_type=video_type,
+    )
+
+def scan_virb_edit(database_path: str) -> list[VirbRoll]:
+    """Rolls from VIRB Edit's movie projects, skipping any whose FIT file isn't in DATA_PATH"""
+    raw_movies = {}
+    for path in glob.glob(f"{database_path}/RawMovies/*/video.xml"):
+        root = ET.parse(path).getroot()
+        fit = root.find('./TelemetryTypeAssociations/TelemetryTypeAssociation_t/SourceFilePath')
+        preview = root.find('./SourceFiles/MediaSourceFile_t/LowResolutionFilePath')
+        if fit is None or preview is None or not fit.text or not preview.text:
+            continue
+        raw_movies[os.path.basename(os.path.dirname(path))] = (fit.text, preview.text.replace('\\', '/').split('/')[-1])
+
+    rolls = []
+    for path in sorted(glob.glob(f"{database_path}/MovieProjects/*/edited_movie.xml")):
+        root = ET.parse(path).getroot()
+        name = root.findtext('Name', '')
+        raw_movie_id = root.findtext('./VideoClips/VideoClip_t/RawMovies/RawMovieDisplay_t/RawMovieId')
+        if raw_movie_id not in raw_movies:
+            print(f"Skipping {name}, raw movie id {raw_movie_id} not found")
+            continue
+        fit, preview = raw_movies[raw_movie_id]
+        if preview in SKIPPED_PREVIEWS:
+            print(f"Skipping {name}, known double video")
+            continue
+        try:
+            roll = parse_project_name(name, fit, preview)
+        except (ValueError, IndexError) as e:
+            print(f"Skipping {name}, can't parse project name: {e}")
+            continue
+        if not os.path.exists(f"{DATA_PATH}/virbs/all/{roll.fit_file}"):
+            print(f"Skipping {name}, {roll.fit_file} not found")
+            continue
+        rolls.append(roll)
+    return sorted(rolls, key=lambda r: r.name)
+
+def get_or_insert_ids(session: Session, model, keys: list[str], rows: list[dict]) -> dict[tuple, int]:
+    """
+    Ids of rows of model by their key columns. Looks up all rows with one query
+    and creates the missing ones with one bulk insert.
+    """
+    columns = [getattr(model, key) for key in keys]
+    unique = {tuple(row[key] for key in keys): row for row in rows}
+    if not unique:
+        return {}
+    ids = {tuple(key): id for id, *key in session.execute(
+        select(model.id, *columns).where(tuple_(*columns).in_(list(unique)))
+    )}
+    missing = [row for key, row in unique.items() if key not in ids]
+    if missing:
+        ids |= {tuple(key): id for id, *key in session.execute(insert(model).returning(model.id, *columns), missing)}
+    return ids
+
+def ingest_rolls(session: Session, rolls: list[VirbRoll], roll_type: RollType) -> int:
+    """
+    Adds rolls and their files with bulk inserts, skipping FIT files that were already ingested.
+    Recordings of the same buggy, date and roll number are added to the same roll.
+    Returns the number of FIT files added, doesn't commit.
+    """
+    ingested = set(session.scalars(
+        select(RollFile.uri).where(RollFile.type == 'fit', RollFile.uri.in_([r.fit_uri for r in rolls]))
+    ))
+    rolls = [r for r in rolls if r.fit_uri not in ingested]
+    if not rolls:
+        return 0
+
+    driver_ids = get_or_insert_ids(session, Driver, ['name'], [dict(name=r.driver) for r in rolls])
+    buggy_ids = get_or_insert_ids(session, Buggy, ['abbreviation'], [
+        dict(abbreviation=r.buggy.lower(), name=BUGGY_NAMES.get(r.buggy.lower(), r.buggy)) for r in rolls
+    ])
+    sensor_ids = get_or_insert_ids(session, Sensor, ['abbreviation'], [
+        dict(abbreviation=r.sensor, type='virb', name=f"Virb {r.sensor}") for r in rolls
+    ])
+    date_ids = get_or_insert_ids(session, RollDate, ['year', 'month', 'day', 'type'], [
+        dict(year=r.date[0], month=r.date[1], day=r.date[2], type=roll_type) for r in rolls
+    ])
+
+    def roll_key(r: VirbRoll) -> tuple:
+        return (buggy_ids[(r.buggy.lower(),)], date_ids[(*r.date, roll_type)], r.roll_number)
+
+    # first recording of a roll sets its driver and start time
+    roll_rows: dict[tuple, dict] = {}
+    for r in rolls:
+        buggy_id, roll_date_id, roll_number = roll_key(r)
+        roll_rows.setdefault((buggy_id, roll_date_id, roll_number), dict(
+            buggy_id=buggy_id, roll_date_id=roll_date_id, roll_number=roll_number,
+            driver_id=driver_ids[(r.driver,)], start_time=r.start_time,
+        ))
+    roll_ids = get_or_insert_ids(session, Roll, ['buggy_id', 'roll_date_id', 'roll_number'], list(roll_rows.values()))
+
+    files = []
+    for r in rolls:
+        roll_id, sensor_id = roll_ids[roll_key(r)], sensor_ids[(r.sensor,)]
+        files.append(dict(roll_id=roll_id, sensor_id=sensor_id, type=r.video_type, uri=r.preview_uri))
+        files.append(dict(roll_id=roll_id, sensor_id=sensor_id, type='fit', uri=r.fit_uri))
+    session.execute(insert(RollFile), files)
+    return len(rolls)
+
+def warm_fit_file(roll_id: int, fit_file: str, start_ms: int | None, end_ms: int | None) -> bool:
+    """
+    Decodes a FIT file into the FIT cache and stores its graphs, map track and the roll's track
+    between start_ms and end_ms. Returns False if they were already cached
+    """
+    key, map_track_key = graphs_cache_key(roll_id, fit_file), map_track_cache_key(roll_id, fit_file)
+    track_key = track_cache_key(roll_id, fit_file, start_ms, end_ms)
+    if graphs_cache.contains(key) and map_track_cache.contains(map_track_key) and tracks_cache.contains(track_key):
+        return False
+    if not graphs_cache.contains(key):
+        graphs_cache.put(key, load_roll_graphs(fit_file))
+    if not map_track_cache.contains(map_track_key):
+        map_track_cache.put(map_track_key, load_map_track(fit_file))
+    if not tracks_cache.contains(track_key):
+        tracks_cache.put(track_key, load_roll_track(fit_file, start_ms, end_ms))
+    return True
+
+def warm_caches(session: Session, fit_uris: list[str]):
+    """Fills the FIT, graphs, map track and track caches for rolls with these FIT files on the analytics pool"""
+    targets = session.execute(
+        select(RollFile.roll_id, RollFile.uri).where(RollFile.type == 'fit', RollFile.uri.in_(fit_uris))
+    ).all()
+    roll_events: dict[int, list] = {}
+    for event in session.execute(
+        select(RollEvent.roll_id, RollEvent.type, RollEvent.timestamp_ms).where(
+            RollEvent.roll_id.in_({roll_id for roll_id, _ in targets}), RollEvent.type.in_(['roll_start', 'roll_end']))
+    ):
+        roll_events.setdefault(event.roll_id, []).append(event)
+    jobs = []
+    for roll_id, uri in targets:
+        fit_file = uri.replace('[[fit]]', 'virbs')
+        args = (roll_id, fit_file, *track_window(roll_events.get(roll_id, [])))
+        jobs.append((('warm', *args), warm_fit_file, args))
+    warmed = failed = 0
+    for (roll_id, uri), result in zip(targets, analytics.run_many(jobs, return_exceptions=True)):
+        if isinstance(result, Exception):
+            failed += 1
+            print(f"Error processing {uri}: {result!r}")
+        else:
+            warmed += result
+    print(f"Cached {warmed} FIT files ({len(targets) - warmed - failed} already cached, {failed} failed)")
+
+def main():
+    parser = ArgumentParser(description="Import VIRB rolls from VIRB Edit's database")
+    parser.add_argument('virb_edit', help="VIRB Edit database folder, containing MovieProjects and RawMovies")
+    parser.add_argument('--roll-type', type=RollType, default=RollType.WEEKEND, help="type of new roll dates")
+    parser.add_argument('--workers', type=int, default=INGEST_WORKERS, help="processes used to decode FIT files and calculate stats")
+    parser.add_argument('--no-warm', action='store_true', help="don't fill the FIT, graphs, track and stats caches")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    # the pool is started by its first job, so this sets its size for warming caches and stats
+    analytics.workers = max(1, args.workers)
+    create_db_and_tables()
+    rolls = scan_virb_edit(args.virb_edit)
+    print(f"Found {len(rolls)} rolls")
+
+    with Session(engine) as session:
+        added = ingest_rolls(session, rolls, args.roll_type)
+        session.commit()
+        print(f"Added {added} FIT files ({len(rolls) - added} already ingested)")
+
+        if not args.no_warm:
+            warm_caches(session, [r.fit_uri for r in rolls])
+            # FIT files that were missing before may have been added now
+            refresh = refresh_stale_roll_stats(session, retry_fit_errors=True)
+            for roll_id, error in refresh.failed.items():
+                print(f"Error calculating stats for roll {roll_id}: {error}")
+            print(f"Calculated stats for {refresh.calculated} rolls ({len(refresh.failed)} failed or without FIT stats)")
+    print(f"Done in {time.perf_counter() - start:.1f}s")
+
+if __name__ == '__main__':
+    main()
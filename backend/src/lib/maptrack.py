@@ -0,0 +1,107 @@
+"""
+Roll tracks for the map, simplified with Douglas-Peucker at several tolerances so long rolls and
+many overlaid rolls can be drawn without downloading the graphs.
+
+Douglas-Peucker is run once per track, recording for each point the largest tolerance it's kept at
+(`simplification_tolerances`), so the track at any tolerance is the points above it.
+"""
+import os
+import numpy as np
+from lib.cache import ResponseCache
+from lib.channels import roll_channels
+from lib.fit import DATA_PATH, fit_source_info
+from lib.metrics import span
+from lib.series import encode_graphs, to_series
+
+# bump when the contents of map tracks change to invalidate cached tracks
+MAP_TRACK_VERSION = 1
+# tolerances (in m) tracks are simplified at, from most to least detailed
+MAP_TRACK_TOLERANCES_M = (0.25, 1.0, 4.0, 16.0)
+# digits of lat/long kept in encoded polylines, 6 is ~0.1 m
+POLYLINE_PRECISION = 6
+EARTH_RADIUS_M = 6_371_000
+
+map_track_cache = ResponseCache(f'{DATA_PATH}/cache/map_tracks', int(os.getenv('MAP_TRACK_CACHE_BYTES', 32 * 2**20)))
+
+def map_track_cache_key(roll_id: int, fit_file: str) -> tuple:
+    """Cache key for a roll's map track, changes when the FIT file is replaced"""
+    source = fit_source_info(fit_file)
+    return (roll_id, fit_file, source['mtime_ns'], source['size'], MAP_TRACK_VERSION)
+
+def simplification_tolerances(x: np.ndarray, y: np.ndarray, min_tolerance: float = 0.0) -> np.ndarray:
+    """
+    Largest Douglas-Peucker tolerance each point of the line through x, y is kept at (inf for the ends).
+    Points only kept below min_tolerance are 0, without splitting the line any further.
+    """
+    n = len(x)
+    tolerances = np.zeros(n)
+    if n == 0:
+        return tolerances
+    tolerances[[0, -1]] = np.inf
+    stack = [(0, n - 1, np.inf)]
+    while stack:
+        start, end, parent = stack.pop()
+        if end - start < 2:
+            continue
+        px, py = x[start + 1:end] - x[start], y[start + 1:end] - y[start]
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        # distance to the segment from start to end (to the start if they're the same point)
+        length_sq = dx * dx + dy * dy
+        along = np.clip((px * dx + py * dy) / length_sq, 0, 1) if length_sq > 0 else 0.0
+        distances = np.hypot(px - along * dx, py - along * dy)
+        split = int(np.argmax(distances))
+        distance = distances[split]
+        if distance <= min_tolerance:
+            continue
+        # a point is only reached at tolerances its parent segments were split at
+        tolerance = min(distance, parent)
+        split += start + 1
+        tolerances[split] = tolerance
+        stack += [(start, split, tolerance), (split, end, tolerance)]
+    return tolerances
+
+def encode_polyline(lat: np.ndarray, long: np.ndarray, precision: int = POLYLINE_PRECISION) -> str:
+    """Encoded polyline (Google's algorithm) of the points, with lat/long rounded to precision digits"""
+    values = np.round(np.column_stack([lat, long]) * 10 ** precision).astype(np.int64)
+    deltas = np.diff(values, axis=0, prepend=0).ravel()
+    chars = []
+    for value in ((deltas << 1) ^ (deltas >> 63)).tolist():
+        while value >= 0x20:
+            chars.append(chr((0x20 | (value & 0x1f)) + 63))
+            value >>= 5
+        chars.append(chr(value + 63))
+    return ''.join(chars)
+
+def calculate_map_track(fit_file: str) -> dict:
+    """Timestamps, positions and speed of the points of a roll's gps track kept at each of MAP_TRACK_TOLERANCES_M"""
+    gps_data = roll_channels(fit_file, ('gps',))['gps']
+    if gps_data is None:
+        return {}
+    lat, long = gps_data.position_lat.to_numpy(), gps_data.position_long.to_numpy()
+    with span('simplify'):
+        # equirectangular projection to m, plenty accurate over the length of a course
+        x = np.radians(long) * np.cos(np.radians(np.mean(lat))) * EARTH_RADIUS_M
+        y = np.radians(lat) * EARTH_RADIUS_M
+        point_tolerances = simplification_tolerances(x, y, MAP_TRACK_TOLERANCES_M[0])
+
+    track = to_series({
+        'timestamp': gps_data.index,
+        'lat': lat,
+        'long': long,
+        'speed': gps_data.speed.to_numpy(),
+    })
+    levels = {}
+    for i, tolerance in enumerate(MAP_TRACK_TOLERANCES_M):
+        kept = point_tolerances > tolerance
+        levels[f'level{i}'] = {name: values[kept] for name, values in track.items()}
+    return levels
+
+def load_map_track(fit_file: str) -> bytes:
+    """Map track of a FIT file encoded with `encode_graphs`, a series per tolerance plus their polylines"""
+    levels = calculate_map_track(fit_file)
+    with span('encode'):
+        return encode_graphs({
+            **levels,
+            'tolerances_m': list(MAP_TRACK_TOLERANCES_M) if levels else [],
+            'polylines': [encode_polyline(level['lat'], level['long']) for level in levels.values()],
+        })
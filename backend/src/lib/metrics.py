@@ -0,0 +1,184 @@
+"""
+Timing spans and counters, exported in Prometheus' text format on /metrics and
+per request in a Server-Timing header.
+
+Spans recorded in an analytics worker are sent back with the job's result (see `run_recorded`),
+then added to the API process's metrics and to the Server-Timing of the requests waiting for it.
+"""
+from bisect import bisect_left
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+import threading
+import time
+from sqlalchemy import Engine, event
+
+type Labels = tuple[tuple[str, str], ...]
+
+# upper bounds (in s) of histogram buckets, Prometheus' defaults
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS = {
+    'srs_span_seconds': ('histogram', "Time spent in each stage of loading and analysing rolls"),
+    'srs_http_requests_total': ('counter', "Requests handled, by route"),
+    'srs_http_request_seconds': ('histogram', "Time to handle a request, by route"),
+    'srs_sql_queries_total': ('counter', "SQL statements executed while handling requests, by route"),
+    'srs_fit_cache_total': ('counter', "FIT file loads, by where the messages came from (memory, disk cache or decoding)"),
+    'srs_fit_memory_bytes': ('gauge', "Estimated size of FIT messages held in memory, by analytics worker pid"),
+    'srs_fit_memory_entries': ('gauge', "Number of FIT message sets held in memory, by analytics worker pid"),
+    'srs_stats_failures_total': ('counter', "Rolls whose stats couldn't be calculated, or only from their events because the FIT file failed"),
+}
+
+class Recorder:
+    """Spans (name, seconds), counter increments and gauges recorded while handling a request or running a job"""
+
+    def __init__(self):
+        self.spans: list[tuple[str, float]] = []
+        self.counts: list[tuple[str, Labels, float]] = []
+        self.gauges: dict[tuple[str, Labels], float] = {}
+        self.queries = 0
+
+# recorder of the request or job being handled in this context
+current: ContextVar[Recorder | None] = ContextVar('recorder', default=None)
+# name of the enclosing span, nested spans are named after it
+_parent: ContextVar[str] = ContextVar('parent_span', default='')
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+def format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+def format_metric(name: str, kind: str, help: str, samples: dict[Labels, float]) -> list[str]:
+    """Lines for a counter or gauge in Prometheus' text format"""
+    return [f'# HELP {name} {help}', f'# TYPE {name} {kind}',
+            *(f'{name}{format_labels(labels)} {format_value(value)}' for labels, value in samples.items())]
+
+class Registry:
+    """Counters, gauges and histograms held by this process"""
+
+    def __init__(self):
+        self.counters: dict[str, dict[Labels, float]] = {}
+        self.gauges: dict[str, dict[Labels, float]] = {}
+        # bucket counts (the last for values above every bucket) followed by the sum
+        self.histograms: dict[str, dict[Labels, list[float]]] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, name: str, labels: Labels, value: float = 1):
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[labels] = series.get(labels, 0) + value
+
+    def set(self, name: str, labels: Labels, value: float):
+        with self.lock:
+            self.gauges.setdefault(name, {})[labels] = value
+
+    def observe(self, name: str, labels: Labels, seconds: float):
+        with self.lock:
+            values = self.histograms.setdefault(name, {}).setdefault(labels, [0] * (len(BUCKETS) + 2))
+            values[bisect_left(BUCKETS, seconds)] += 1
+            values[-1] += seconds
+
+    def render(self) -> list[str]:
+        lines = []
+        with self.lock:
+            for name, series in sorted((self.counters | self.gauges).items()):
+                kind, help = METRICS[name]
+                lines += format_metric(name, kind, help, series)
+            for name, series in sorted(self.histograms.items()):
+                kind, help = METRICS[name]
+                lines += [f'# HELP {name} {help}', f'# TYPE {name} {kind}']
+                for labels, values in series.items():
+                    count = 0
+                    for bound, bucket in zip((*BUCKETS, '+Inf'), values):
+                        count += bucket
+                        lines.append(f'{name}_bucket{format_labels((*labels, ('le', str(bound))))} {count}')
+                    lines.append(f'{name}_sum{format_labels(labels)} {format_value(values[-1])}')
+                    lines.append(f'{name}_count{format_labels(labels)} {count}')
+        return lines
+
+registry = Registry()
+
+def inc(name: str, value: float = 1, **labels: str):
+    label_tuple = tuple(labels.items())
+    registry.inc(name, label_tuple, value)
+    recorder = current.get()
+    if recorder is not None:
+        recorder.counts.append((name, label_tuple, value))
+
+def set_gauge(name: str, value: float, **labels: str):
+    label_tuple = tuple(labels.items())
+    registry.set(name, label_tuple, value)
+    recorder = current.get()
+    if recorder is not None:
+        recorder.gauges[(name, label_tuple)] = value
+
+def add_span(name: str, seconds: float):
+    registry.observe('srs_span_seconds', (('span', name),), seconds)
+    recorder = current.get()
+    if recorder is not None:
+        recorder.spans.append((name, seconds))
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Times a stage. Spans inside it are named after it, e.g. accelerometer.decimation"""
+    name = _parent.get() + name
+    token = _parent.set(f'{name}.')
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _parent.reset(token)
+        add_span(name, time.perf_counter() - start)
+
+def run_recorded[T](fn: Callable[..., T], *args) -> tuple[T, Recorder]:
+    """Runs fn (in an analytics worker) and returns its result with the spans and counts recorded meanwhile"""
+    recorder = Recorder()
+    token = current.set(recorder)
+    try:
+        return fn(*args), recorder
+    finally:
+        current.reset(token)
+
+def merge(recorder: Recorder):
+    """Adds what a worker recorded for a job to this process's metrics"""
+    for name, seconds in recorder.spans:
+        registry.observe('srs_span_seconds', (('span', name),), seconds)
+    for name, labels, value in recorder.counts:
+        registry.inc(name, labels, value)
+    for (name, labels), value in recorder.gauges.items():
+        registry.set(name, labels, value)
+
+def count_queries(engine: Engine):
+    """Records the SQL statements run with engine as sql spans of the current request"""
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_execute(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info['query_start'].pop()
+        recorder = current.get()
+        if recorder is not None:
+            recorder.queries += 1
+            recorder.spans.append(('sql', seconds))
+
+def record_request(recorder: Recorder, route: str, method: str, status: int, seconds: float):
+    labels = (('route', route), ('method', method))
+    registry.inc('srs_http_requests_total', (*labels, ('status', str(status))))
+    registry.observe('srs_http_request_seconds', labels, seconds)
+    registry.inc('srs_sql_queries_total', labels, recorder.queries)
+
+def server_timing(recorder: Recorder, seconds: float) -> str:
+    """Server-Timing header value, adding up the time of spans with the same name"""
+    totals: dict[str, float] = {}
+    for name, span_seconds in recorder.spans:
+        totals[name] = totals.get(name, 0) + span_seconds
+    entries = [f'{name};dur={total * 1000:.1f}' for name, total in totals.items() if name != 'sql']
+    if recorder.queries:
+        entries.append(f'sql;desc="{recorder.queries} queries";dur={totals["sql"] * 1000:.1f}')
+    entries.append(f'total;dur={seconds * 1000:.1f}')
+    return ', '.join(entries)
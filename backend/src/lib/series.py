@@ -0,0 +1,93 @@
+import json
+import struct
+import numpy as np
+
+type Series = dict[str, np.ndarray]
+"""Columns of equal length, including a `timestamp` column in ms"""
+
+# Graph data is a dict of named series plus json values (e.g. camera_starts).
+# It's stored as a json header followed by the raw little endian column buffers,
+# so it can be read back without copying or parsing every value.
+#
+# Layout: b'SRSG', uint32 header length, utf-8 json header (padded with spaces so the
+# buffers start at a multiple of 8 bytes), then each column's buffer in header order.
+# Header: {"series": {name: {"length": n, "columns": {column: numpy dtype, e.g. "<f8"}}},
+#          "values": {name: json value}}
+# Columns are all 8 bytes per value, so every buffer can be viewed directly as a
+# Float64Array/BigInt64Array in the browser.
+MAGIC = b'SRSG'
+GRAPHS_MEDIA_TYPE = 'application/vnd.srs.graphs'
+
+def to_series(columns: dict) -> Series:
+    """Converts columns to numpy arrays, as float64 or int64 so they're encoded the same way"""
+    series = {}
+    for key, values in columns.items():
+        array = np.asarray(values)
+        series[key] = array.astype(np.int64 if np.issubdtype(array.dtype, np.integer) else np.float64)
+    return series
+
+def encode_graphs(graphs: dict) -> bytes:
+    header: dict = {'series': {}, 'values': {}}
+    buffers = []
+    for name, value in graphs.items():
+        if not isinstance(value, dict):
+            header['values'][name] = value
+            continue
+        header['series'][name] = {
+            'length': len(next(iter(value.values()), [])),
+            'columns': {key: array.dtype.newbyteorder('<').str for key, array in value.items()},
+        }
+        buffers += [np.ascontiguousarray(array, dtype=array.dtype.newbyteorder('<')).tobytes() for array in value.values()]
+
+    header_bytes = json.dumps(header).encode()
+    header_bytes += b' ' * (-(len(MAGIC) + 4 + len(header_bytes)) % 8)
+    return b''.join([MAGIC, struct.pack('<I', len(header_bytes)), header_bytes, *buffers])
+
+def decode_graphs(content: bytes) -> dict:
+    """Reads graphs written by `encode_graphs`, series columns are views into content"""
+    if content[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not encoded graph data")
+    header_length, = struct.unpack_from('<I', content, len(MAGIC))
+    offset = len(MAGIC) + 4
+    header = json.loads(content[offset:offset + header_length])
+    offset += header_length
+
+    graphs = dict(header['values'])
+    for name, series_header in header['series'].items():
+        series = {}
+        for key, dtype in series_header['columns'].items():
+            series[key] = np.frombuffer(content, dtype=np.dtype(dtype), count=series_header['length'], offset=offset)
+            offset += series[key].nbytes
+        graphs[name] = series
+    return graphs
+
+def downsample(series: Series, points: int | None = None,
+               start_ms: int | None = None, end_ms: int | None = None) -> Series:
+    """
+    Restricts series to timestamps in [start_ms, end_ms] and reduces it to roughly `points` rows.
+    The rows with the min and max value of each column in evenly sized buckets are kept,
+    so peaks in every column survive and columns stay aligned.
+    """
+    timestamps = series['timestamp']
+    start = 0 if start_ms is None else int(np.searchsorted(timestamps, start_ms, side='left'))
+    end = len(timestamps) if end_ms is None else int(np.searchsorted(timestamps, end_ms, side='right'))
+    series = {key: values[start:end] for key, values in series.items()}
+    length = end - start
+
+    value_keys = [key for key in series if key != 'timestamp']
+    if points is None or length <= points or not value_keys:
+        return series
+
+    buckets = max(1, points // (2 * len(value_keys)))
+    bucket_size = -(-length // buckets)
+    padding = buckets * bucket_size - length
+    bucket_starts = np.arange(buckets) * bucket_size
+
+    keep = [np.array([0, length - 1])]
+    for key in value_keys:
+        values = series[key].astype(np.float64)
+        padded = np.concatenate([values, np.full(padding, np.nan)]).reshape(buckets, bucket_size)
+        keep.append(bucket_starts + np.argmin(np.where(np.isnan(padded), np.inf, padded), axis=1))
+        keep.append(bucket_starts + np.argmax(np.where(np.isnan(padded), -np.inf, padded), axis=1))
+    rows = np.unique(np.minimum(np.concatenate(keep), length - 1))
+    return {key: values[rows] for key, values in series.items()}
@@ -0,0 +1,144 @@
+from collections.abc import Collection
+from typing import NamedTuple
+from db.database import Roll, RollStats
+from lib.events import calculate_hill_times, calculate_freeroll_stats
+from lib.executor import analytics
+from lib.metrics import inc
+from sqlalchemy import select, or_
+from sqlalchemy.orm import Session, selectinload
+
+# bump when the way stats are calculated changes to recalculate stored stats
+STATS_VERSION = 2
+
+STAT_FIELDS = [
+    'hill1_time_ms', 'hill2_time_ms', 'hill3_time_ms', 'hill4_time_ms', 'hill5_time_ms', 'course_time_ms',
+    'freeroll_time_ms', 'video_roll_start_ms', 'video_roll_end_ms',
+    'max_speed', 'max_energy', 'freeroll_energy_loss',
+    'pickup_timestamp_ms', 'pickup_energy', 'pickup_speed', 'rollup_height',
+]
+
+def get_fit_file(roll: Roll) -> str | None:
+    """Path (relative to DATA_PATH) of a roll's FIT file, None if it doesn't have exactly one"""
+    fit_files = [rf for rf in roll.roll_files if rf.type == 'fit']
+    return fit_files[0].uri.replace('[[fit]]', 'virbs') if len(fit_files) == 1 else None
+
+class EventData(NamedTuple):
+    """Picklable copy of the RollEvent fields used for stats"""
+    type: str
+    tag: str | None
+    timestamp_ms: int
+
+class StatsJob(NamedTuple):
+    fit_file: str | None
+    roll_events: tuple[EventData, ...]
+    
+    @classmethod
+    def from_roll(cls, roll: Roll) -> "StatsJob":
+        return cls(get_fit_file(roll), tuple(EventData(e.type, e.tag, e.timestamp_ms) for e in roll.roll_events))
+
+def calculate_roll_stats(job: StatsJob) -> dict:
+    """
+    Stats from a roll's events, plus the ones from its FIT file. If the FIT file can't be read
+    (missing, corrupt) the stats from events are still returned, with the error in 'fit_error'.
+    """
+    stats = {}
+    roll_starts = [e.timestamp_ms for e in job.roll_events if e.type == 'roll_start']
+    roll_ends = [e.timestamp_ms for e in job.roll_events if e.type == 'roll_end']
+
+    hill_times = calculate_hill_times(job.roll_events) # type: ignore
+    for hill_num, time_ms in hill_times.items():
+        if time_ms is not None:
+            stats[f'hill{hill_num}_time_ms'] = time_ms
+
+    if len(roll_starts) == 1 and len(roll_ends) == 1:
+        stats['course_time_ms'] = roll_ends[0] - roll_starts[0]
+
+    stats.update(calculate_freeroll_stats(None, job.roll_events)) # type: ignore
+    if job.fit_file is not None:
+        try:
+            stats.update(calculate_freeroll_stats(job.fit_file, job.roll_events)) # type: ignore
+        except Exception as e:
+            stats['fit_error'] = repr(e)
+    return stats
+
+def calculate_roll_stats_batch(jobs: list[StatsJob]) -> list[dict | Exception]:
+    """
+    Calculates stats for many rolls, spread across the analytics pool.
+    Results are in the same order as jobs. A roll that fails gets its exception instead of stats.
+    """
+    return analytics.run_many([(('stats', job), calculate_roll_stats, (job,)) for job in jobs], return_exceptions=True)
+
+def store_roll_stats(session: Session, roll_id: int, stats: dict) -> RollStats:
+    row = session.get(RollStats, roll_id)
+    if row is None:
+        row = RollStats(roll_id=roll_id)
+        session.add(row)
+    row.version = STATS_VERSION
+    for field in STAT_FIELDS:
+        setattr(row, field, stats.get(field))
+    row.fit_error = stats.get('fit_error')
+    if row.fit_error is not None:
+        inc('srs_stats_failures_total')
+    return row
+
+def refresh_roll_stats(session: Session, roll: Roll) -> RollStats:
+    """
+    Recalculates and stores stats for a roll. Call after a roll's events or files change.
+    If the FIT file fails the stats from events are stored, with the error in fit_error.
+    If no stats can be calculated the error is raised and the roll's old stats are deleted, so they're calculated again later.
+    """
+    job = StatsJob.from_roll(roll)
+    try:
+        stats = analytics.run(('stats', job), calculate_roll_stats, job)
+    except Exception:
+        inc('srs_stats_failures_total')
+        if (row := session.get(RollStats, roll.id)) is not None:
+            session.delete(row)
+        raise
+    return store_roll_stats(session, roll.id, stats)
+
+class StatsRefresh(NamedTuple):
+    calculated: int
+    # error of each roll whose stats couldn't be calculated, or only from events, by roll id
+    failed: dict[int, str]
+
+def refresh_stale_roll_stats(session: Session, retry_fit_errors: bool = False,
+                             roll_ids: Collection[int] | None = None) -> StatsRefresh:
+    """
+    Calculates stats for rolls (all, or only roll_ids) that don't have any or were calculated by an older version.
+    With retry_fit_errors, rolls whose FIT file failed last time are tried again (e.g. after files were copied in).
+    Rolls that fail entirely are left without stats, so they're tried again next time.
+    """
+    stale = or_(RollStats.roll_id.is_(None), RollStats.version != STATS_VERSION)
+    if retry_fit_errors:
+        stale = or_(stale, RollStats.fit_error.is_not(None))
+    query = select(Roll).options(
+        selectinload(Roll.roll_files),
+        selectinload(Roll.roll_events),
+    ).outerjoin(RollStats).where(stale)
+    if roll_ids is not None:
+        query = query.where(Roll.id.in_(roll_ids))
+
+    rolls = session.scalars(query).all()
+    results = calculate_roll_stats_batch([StatsJob.from_roll(roll) for roll in rolls])
+    failed = {}
+    for roll, stats in zip(rolls, results):
+        if isinstance(stats, Exception):
+            failed[roll.id] = repr(stats)
+            inc('srs_stats_failures_total')
+            # stats of an older version would otherwise stay in place as if they were current
+            if (row := session.get(RollStats, roll.id)) is not None:
+                session.delete(row)
+            continue
+        if stats.get('fit_error') is not None:
+            failed[roll.id] = stats['fit_error']
+        store_roll_stats(session, roll.id, stats)
+    if rolls:
+        session.commit()
+    return StatsRefresh(len(rolls) - len(failed), failed)
+
+def roll_stats_dict(row: RollStats) -> dict:
+    stats = {field: getattr(row, field) for field in STAT_FIELDS if getattr(row, field) is not None}
+    if row.fit_error is not None:
+        stats['fit_error'] = row.fit_error
+    return stats
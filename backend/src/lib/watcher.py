@@ -0,0 +1,158 @@
+from collections import OrderedDict
+from datetime import datetime, timezone
+import os
+import threading
+import time
+
+from db.database import engine, Roll, RollFile
+from lib.compare import load_roll_track, track_cache_key, track_window, tracks_cache
+from lib.executor import analytics
+from lib.fit import DATA_PATH, load_fit_file
+from lib.graphs import graphs_cache, graphs_cache_key, load_roll_graphs
+from lib.maptrack import load_map_track, map_track_cache, map_track_cache_key
+from lib.stats import STATS_VERSION, refresh_roll_stats
+from sqlalchemy import select
+from sqlalchemy.orm import Session, selectinload
+
+# set to watch data/virbs and precompute caches for new FIT files in the background
+FIT_WATCH = os.getenv('FIT_WATCH', '').lower() in ('1', 'true', 'yes')
+# seconds between scans of data/virbs
+FIT_WATCH_INTERVAL = float(os.getenv('FIT_WATCH_INTERVAL', 30))
+# seconds to pause after each file, so background work leaves room for requests
+FIT_WATCH_DELAY = float(os.getenv('FIT_WATCH_DELAY', 1))
+# files modified more recently than this (in s) may still be copying, they're picked up by a later scan
+FIT_SETTLE_S = 10
+
+def decode_fit_file(fit_file: str):
+    """Fills the FIT cache for a file, without reading any messages back from it"""
+    load_fit_file(fit_file, ())
+
+class FitWatcher:
+    """
+    Polls data/virbs for new or changed FIT files and precomputes their FIT cache,
+    graphs, map tracks, comparison tracks and stats, so the first request for a new roll doesn't pay for them.
+    Work runs on the analytics pool one file at a time, and waits while requests are using it.
+    """
+
+    def __init__(self, interval: float, delay: float):
+        self.interval = interval
+        self.delay = delay
+        self.seen: dict[str, tuple[int, int]] = {}
+        # FIT file -> whether it changed since the watcher started (so stats must be recalculated)
+        self.pending: OrderedDict[str, bool] = OrderedDict()
+        self.current: str | None = None
+        self.processed = 0
+        self.failed = 0
+        self.last_scan: datetime | None = None
+        self.thread: threading.Thread | None = None
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+
+    def start(self):
+        if self.thread is None:
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self._run, name='fit-watcher', daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+            self.thread = None
+
+    def scan(self) -> list[str]:
+        """FIT files (relative to DATA_PATH) that are new or changed since the last scan"""
+        changed = []
+        now_ns = time.time_ns()
+        for root, _, files in os.walk(f'{DATA_PATH}/virbs'):
+            for name in files:
+                if not name.lower().endswith('.fit'): continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                rel_path = os.path.relpath(path, DATA_PATH)
+                signature = (stat.st_mtime_ns, stat.st_size)
+                if self.seen.get(rel_path) == signature or now_ns - stat.st_mtime_ns < FIT_SETTLE_S * 1e9:
+                    continue
+                self.seen[rel_path] = signature
+                changed.append(rel_path)
+        self.last_scan = datetime.now(timezone.utc)
+        return changed
+
+    def process(self, fit_file: str, changed: bool):
+        """Precomputes caches for a FIT file and stats for the rolls that use it"""
+        uri = '[[fit]]' + fit_file.removeprefix('virbs')
+        with Session(engine) as session:
+            rolls = session.scalars(
+                select(Roll).join(Roll.roll_files).where(RollFile.type == 'fit', RollFile.uri == uri).options(
+                    selectinload(Roll.roll_files),
+                    selectinload(Roll.roll_events),
+                    selectinload(Roll.stats),
+                )
+            ).unique().all()
+            if not rolls:
+                analytics.run(('fit', fit_file, self.seen.get(fit_file)), decode_fit_file, fit_file)
+            for roll in rolls:
+                # same key as the graphs endpoint, so a request for this roll joins the running job
+                key = graphs_cache_key(roll.id, fit_file)
+                if not graphs_cache.contains(key):
+                    graphs_cache.put(key, analytics.run(('graphs', key), load_roll_graphs, fit_file))
+                key = map_track_cache_key(roll.id, fit_file)
+                if not map_track_cache.contains(key):
+                    map_track_cache.put(key, analytics.run(('map_track', key), load_map_track, fit_file))
+                start_ms, end_ms = track_window(roll.roll_events)
+                key = track_cache_key(roll.id, fit_file, start_ms, end_ms)
+                if not tracks_cache.contains(key):
+                    tracks_cache.put(key, analytics.run(('track', key), load_roll_track, fit_file, start_ms, end_ms))
+                if changed or roll.stats is None or roll.stats.version != STATS_VERSION or roll.stats.fit_error is not None:
+                    refresh_roll_stats(session, roll)
+            session.commit()
+
+    def _wait_for_idle(self):
+        while not self.stopped.is_set() and analytics.stats()['in_flight'] > 0:
+            self.stopped.wait(self.delay)
+
+    def _run(self):
+        first_scan = True
+        while not self.stopped.is_set():
+            try:
+                changed = self.scan()
+            except OSError as e:
+                print(f"Error scanning for FIT files: {e!r}")
+                changed = []
+            with self.lock:
+                for fit_file in changed:
+                    self.pending[fit_file] = not first_scan
+            first_scan = False
+
+            while self.pending and not self.stopped.is_set():
+                self._wait_for_idle()
+                with self.lock:
+                    fit_file, changed_file = self.pending.popitem(last=False)
+                    self.current = fit_file
+                try:
+                    self.process(fit_file, changed_file)
+                    self.processed += 1
+                except Exception as e:
+                    self.failed += 1
+                    print(f"Error precomputing {fit_file}: {e!r}")
+                self.current = None
+                self.stopped.wait(self.delay)
+            self.stopped.wait(self.interval)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'enabled': FIT_WATCH,
+                'running': self.thread is not None and self.thread.is_alive(),
+                'files': len(self.seen),
+                'pending': len(self.pending),
+                'current': self.current,
+                'processed': self.processed,
+                'failed': self.failed,
+                'last_scan': self.last_scan,
+            }
+
+watcher = FitWatcher(FIT_WATCH_INTERVAL, FIT_WATCH_DELAY)
@@ -0,0 +1,12 @@
+"""
+Tests, run from backend/ with `python -m unittest discover -s tests -t .` (or pytest).
+Modules under src/ are imported as the API imports them, with data and the database in a temporary folder.
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+DATA_PATH = os.environ.setdefault('DATA_PATH', tempfile.mkdtemp(prefix='srs-test-'))
+os.environ.setdefault('DB_PATH', f'{DATA_PATH}/db/srs.db')
+os.makedirs(f'{DATA_PATH}/db', exist_ok=True)
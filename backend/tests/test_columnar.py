@@ -0,0 +1,44 @@
+import os
+import shutil
+import tempfile
+import unittest
+from lib.columnar import MessageTable, read_meta, read_tables, write_tables
+
+RECORDS = [
+    {'timestamp': 1, 'sample_time_offset': [0, 10, 20], 'name': 'a'},
+    {'timestamp': 2, 'sample_time_offset': [0, 10], 'speed': 1.5},
+]
+
+class WriteTablesTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'file.fit')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def read(self) -> list[dict]:
+        return list(read_tables(self.path, read_meta(self.path))['records'])
+
+    def test_round_trip(self):
+        write_tables(self.path, {'records': MessageTable.from_records(RECORDS)}, {'version': 1})
+        self.assertEqual(self.read(), RECORDS)
+
+    def test_keeps_tables_already_written(self):
+        write_tables(self.path, {'records': MessageTable.from_records(RECORDS)}, {'version': 1})
+        written = os.stat(os.path.join(self.path, 'meta.json')).st_ino
+        # a second process that decoded the same file finishes later
+        write_tables(self.path, {'records': MessageTable.from_records(RECORDS)}, {'version': 1})
+        self.assertEqual(os.stat(os.path.join(self.path, 'meta.json')).st_ino, written)
+        self.assertEqual(os.listdir(self.dir), ['file.fit'])
+        self.assertEqual(self.read(), RECORDS)
+
+    def test_replaces_outdated_tables(self):
+        write_tables(self.path, {'records': MessageTable.from_records(RECORDS[:1])}, {'version': 1})
+        write_tables(self.path, {'records': MessageTable.from_records(RECORDS)}, {'version': 2})
+        self.assertEqual(read_meta(self.path)['meta'], {'version': 2})
+        self.assertEqual(os.listdir(self.dir), ['file.fit'])
+        self.assertEqual(self.read(), RECORDS)
+
+if __name__ == '__main__':
+    unittest.main()
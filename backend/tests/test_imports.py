@@ -0,0 +1,21 @@
+import os
+import subprocess
+import sys
+import unittest
+
+SRC_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+# only imported by the analytics workers, never by the API process itself
+HEAVY_MODULES = ('pandas', 'geopandas', 'shapely', 'pyproj', 'rasterio', 'scipy', 'garmin_fit_sdk', 'lib.geo')
+
+class ApiImportsTest(unittest.TestCase):
+    def test_heavy_modules_not_imported(self):
+        # in a fresh interpreter, other tests may have imported them here
+        result = subprocess.run(
+            [sys.executable, '-c', 'import sys, api.main; print(*sorted(set(sys.argv[1:]) & sys.modules.keys()))', *HEAVY_MODULES],
+            cwd=SRC_PATH, env=os.environ | {'PYTHONPATH': SRC_PATH}, capture_output=True, text=True,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.split(), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import unittest
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from db.database import engine, create_db_and_tables, Buggy, Driver, Roll, RollDate, RollFile, RollHill, RollType, Sensor
+from api.routers.rolls import RollFileInput, RollHillInput, resolve_pushers, resolve_sensors, sync_roll_children
+
+class QueryCounter:
+    """Counts statements sent to the database while in use"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(engine, 'before_cursor_execute', self)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(engine, 'before_cursor_execute', self)
+
+class SyncRollChildrenTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        create_db_and_tables()
+
+    def setUp(self):
+        self.session = Session(engine)
+        self.driver, self.buggy = Driver(name='Driver'), Buggy(name='Buggy', abbreviation='bg')
+        self.roll_date = RollDate(year=2025, month=9, day=20, type=RollType.WEEKEND)
+        self.roll_number = 0
+        self.new_roll()
+
+    def new_roll(self):
+        """Roll without files or hills that sync_roll_children is run on"""
+        self.roll_number += 1
+        self.roll = Roll(driver=self.driver, buggy=self.buggy, roll_date=self.roll_date, roll_number=self.roll_number)
+        self.session.add(self.roll)
+        self.session.flush()
+
+    def tearDown(self):
+        self.session.rollback()
+        self.session.close()
+
+    def add_sensors(self, abbreviations: set[str]):
+        # sensors need a type and name, so unlike pushers they can't be created from a roll
+        self.session.add_all([Sensor(type='virb', name=abbreviation, abbreviation=abbreviation) for abbreviation in abbreviations])
+        self.session.flush()
+
+    def inputs(self, n: int, prefix: str) -> tuple[list[RollFileInput], list[RollHillInput]]:
+        self.add_sensors({f'{prefix}{i}' for i in range(n)})
+        files = [RollFileInput(type='fit', uri=f'[[fit]]/all/{prefix}{i}.fit', sensor_abbreviation=f'{prefix}{i}') for i in range(n)]
+        hills = [RollHillInput(hill_number=i % 5 + 1, pusher_name=f'{prefix}{i}') for i in range(n)]
+        return files, hills
+
+    def sync(self, files: list[RollFileInput], hills: list[RollHillInput]) -> int:
+        with QueryCounter() as queries:
+            sync_roll_children(self.session, self.roll.id, files, hills)
+        return queries.count
+
+    def files(self) -> set[str]:
+        return set(self.session.scalars(select(RollFile.uri).where(RollFile.roll_id == self.roll.id)))
+
+    def hills(self) -> set[tuple[str, int]]:
+        self.session.expire_all()
+        return {(hill.pusher.name, hill.hill_number) for hill in self.session.scalars(select(RollHill).where(RollHill.roll_id == self.roll.id))}
+
+    def test_resolve_query_count(self):
+        for n in (1, 5):
+            with self.subTest(n=n):
+                names = {f'resolve{n}-{i}' for i in range(n)}
+                self.add_sensors(names)
+                with QueryCounter() as queries:
+                    # one query to look them up and one insert for the missing pushers
+                    self.assertEqual(resolve_pushers(self.session, names).keys(), names)
+                    self.assertEqual(resolve_sensors(self.session, names).keys(), names)
+                self.assertEqual(queries.count, 3)
+                with QueryCounter() as queries:
+                    resolve_pushers(self.session, names)
+                    resolve_sensors(self.session, names)
+                self.assertEqual(queries.count, 2)
+
+    def test_sync_query_count(self):
+        for n in (1, 5):
+            with self.subTest(n=n):
+                self.new_roll()
+                files, hills = self.inputs(n, f'add{n}-')
+                # pushers looked up and created, sensors looked up, files and hills loaded and inserted
+                self.assertEqual(self.sync(files, hills), 7)
+                self.assertEqual(self.files(), {f.uri for f in files})
+                self.assertEqual(self.hills(), {(h.pusher_name, h.hill_number) for h in hills})
+                # unchanged, only loads
+                self.assertEqual(self.sync(files, hills), 4)
+                # all replaced, existing ones also deleted
+                files, hills = self.inputs(n, f'replace{n}-')
+                self.assertEqual(self.sync(files, hills), 9)
+                self.assertEqual(self.files(), {f.uri for f in files})
+                self.assertEqual(self.hills(), {(h.pusher_name, h.hill_number) for h in hills})
+
+    def test_hill_with_several_pushers(self):
+        hills = [RollHillInput(hill_number=1, pusher_name='First'), RollHillInput(hill_number=1, pusher_name='Second'),
+                 RollHillInput(hill_number=2, pusher_name='First')]
+        self.sync([], hills)
+        self.assertEqual(self.hills(), {('First', 1), ('Second', 1), ('First', 2)})
+        self.sync([], hills[1:])
+        self.assertEqual(self.hills(), {('Second', 1), ('First', 2)})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+import numpy as np
+import pandas as pd
+from lib.columnar import MessageTable
+from lib.fit import get_sensor_data
+from lib.signal import unfiorm_sample
+
+FIELDS = {'x': 'accel_x', 'y': 'accel_y', 'z': 'accel_z'}
+CALIBRATION = {
+    'orientation_matrix': [0, -1, 0, 1, 0, 0, 0, 0, -1],
+    'level_shift': 2048,
+    'offset_cal': [12, -7, 30],
+    'calibration_factor': 9810,
+    'calibration_divisor': 4096,
+}
+
+def legacy_get_sensor_data(calibration: dict, sensor_messages: list[dict], fields: dict[str, str], decimation: int = 1):
+    """get_sensor_data as it was before it was vectorized, looping over every sample"""
+    from scipy import signal
+    raw_list = []
+    for group in sensor_messages:
+        base_timestamp = group['timestamp'] * 1000 + group['timestamp_ms']
+        for i, offset in enumerate(group['sample_time_offset']):
+            entry = {
+                'timestamp': base_timestamp + offset,
+            } | {key: group[name][i] for key, name in fields.items()}
+            raw_list.append(entry)
+    raw = pd.DataFrame.from_records(raw_list)
+    raw = raw.set_index('timestamp').sort_index()
+
+    data = np.array(calibration['orientation_matrix']).reshape(3, 3) @ ((raw.to_numpy() \
+    - calibration['level_shift'] - calibration['offset_cal']) * \
+    (calibration['calibration_factor'] / calibration['calibration_divisor'])).T
+    data = pd.DataFrame(data.T, columns=list(fields.keys()), index=raw.index)
+    fs = 1000 / np.median(np.diff(data.index))
+
+    if decimation > 1:
+        uniform_data = unfiorm_sample(data)
+        decimated_data = signal.decimate(uniform_data.to_numpy().T, decimation).T
+        data = pd.DataFrame(decimated_data, columns=list(fields.keys()),
+                            index=uniform_data.index[::decimation])
+        fs = fs / decimation
+
+    data['timestamp'] = data.index
+    return raw, data, float(fs)
+
+def sensor_messages(count: int, seed: int = 0) -> list[dict]:
+    """
+    Accelerometer messages of 10 samples 10 ms apart, all sharing one sample_time_offset list
+    (as the FIT SDK returns them), out of order, with a shorter batch at the end.
+    """
+    rng = np.random.default_rng(seed)
+    offsets = list(range(0, 100, 10))
+    messages = []
+    for i in rng.permutation(count):
+        messages.append({
+            'timestamp': 1_000_000 + int(i) // 10,
+            'timestamp_ms': int(i) % 10 * 100,
+            'sample_time_offset': offsets,
+            **{name: rng.integers(0, 4096, len(offsets)).tolist() for name in FIELDS.values()},
+        })
+    last = messages[-1]
+    messages[-1] = last | {'sample_time_offset': offsets[:4], **{name: last[name][:4] for name in FIELDS.values()}}
+    return messages
+
+class SensorDataTest(unittest.TestCase):
+    def assert_same(self, expected, actual):
+        for expected_frame, actual_frame in zip(expected[:2], actual[:2]):
+            self.assertEqual(list(expected_frame.columns), list(actual_frame.columns))
+            np.testing.assert_array_equal(expected_frame.index.to_numpy(), actual_frame.index.to_numpy())
+            np.testing.assert_allclose(expected_frame.to_numpy(dtype=float), actual_frame.to_numpy(dtype=float), rtol=1e-12)
+        self.assertEqual(expected[2], actual[2])
+
+    def test_matches_loop(self):
+        messages = sensor_messages(200)
+        expected = legacy_get_sensor_data(CALIBRATION, messages, FIELDS)
+        self.assert_same(expected, get_sensor_data(CALIBRATION, messages, FIELDS))
+        self.assert_same(expected, get_sensor_data(CALIBRATION, MessageTable.from_records(messages), FIELDS))
+
+    def test_matches_loop_decimated(self):
+        messages = sensor_messages(200, seed=1)
+        expected = legacy_get_sensor_data(CALIBRATION, messages, FIELDS, decimation=20)
+        self.assert_same(expected, get_sensor_data(CALIBRATION, MessageTable.from_records(messages), FIELDS, decimation=20))
+
+if __name__ == '__main__':
+    unittest.main()
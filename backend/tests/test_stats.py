@@ -0,0 +1,29 @@
+import unittest
+from lib.stats import EventData, StatsJob, calculate_roll_stats
+
+EVENTS = (
+    EventData('roll_start', None, 1_005_000),
+    EventData('hill_start', '1', 1_006_000),
+    EventData('hill_start', '2', 1_020_000),
+    EventData('freeroll_start', None, 1_030_000),
+    EventData('hill_start', '3', 1_060_000),
+    EventData('hill_start', '4', 1_070_000),
+    EventData('hill_start', '5', 1_080_000),
+    EventData('roll_end', None, 1_085_000),
+)
+
+class RollStatsTest(unittest.TestCase):
+    def test_without_fit_file(self):
+        stats = calculate_roll_stats(StatsJob(None, EVENTS))
+        self.assertEqual(stats['course_time_ms'], 80_000)
+        self.assertEqual(stats['freeroll_time_ms'], 30_000)
+        self.assertEqual(stats['hill1_time_ms'], 14_000)
+        self.assertNotIn('fit_error', stats)
+
+    def test_missing_fit_file_keeps_event_stats(self):
+        stats = calculate_roll_stats(StatsJob('virbs/all/missing.fit', EVENTS))
+        self.assertEqual(stats | {'fit_error': None}, calculate_roll_stats(StatsJob(None, EVENTS)) | {'fit_error': None})
+        self.assertIn('FileNotFoundError', stats['fit_error'])
+
+if __name__ == '__main__':
+    unittest.main()